@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Timings of the map's hot paths on made-up tracks, without a display
+
+	python3 bench.py -o before.json
+	python3 bench.py -o after.json --compare before.json
+	python3 bench.py --sizes 1000 10000 --only hover nearest_vertex
+
+Tracks are seeded random walks of each size, so every run times the same
+work. Routing and geocoding go to the stand-ins in standins.py over real
+HTTP on localhost. Each result has the best and median of several runs,
+and per_op, the best divided by the operations in a run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import geometry
+import gpxio
+import network
+from track import Track
+from spatial import GridIndex, nearest_on_track
+from cache import Cache
+from geocode import Geocoder
+from standins import StandIns
+
+SIZES = (1000, 10000, 100000, 1000000)
+# Routes bigger than this aren't something ORS would send
+ROUTE_MAX = 100000
+# Mouse positions per hover and nearest-vertex run, and lookups per geocoding run
+LOOKUPS = 1000
+GEOCODES = 100
+# Keep running each benchmark until it has taken this long, up to REPEAT times
+MIN_TIME = 0.5
+REPEAT = 5
+STEP = 10
+
+def synthetic_track(n, seed=0):
+	""" Random walk of n points STEP metres apart that mostly keeps going
+	the same way, with rolling heights, like a recorded track """
+	rng = np.random.default_rng(seed)
+	heading = np.cumsum(rng.normal(0, 0.2, n))
+	lat = 51.5 + np.cumsum(np.cos(heading)) * STEP / 111195
+	lon = -0.1 + np.cumsum(np.sin(heading)) * STEP / (111195 * np.cos(51.5 * geometry.RAD))
+	ele = 100 + 50 * np.sin(np.arange(n) / 500) + rng.normal(0, 1, n)
+	return Track(lat, lon, ele)
+
+def measure(fn, min_time=MIN_TIME, repeat=REPEAT):
+	""" Times fn() until min_time has passed, at least once and at most
+	repeat times. fn returns the operations it did. """
+	times = []
+	ops = 1
+	while len(times) < repeat and (not times or sum(times) < min_time):
+		start = time.perf_counter()
+		ops = fn()
+		times.append(time.perf_counter() - start)
+	best = min(times)
+	return {'runs': len(times), 'ops': ops, 'min': best, 'median': float(np.median(times)), 'per_op': best / ops}
+
+class Bench:
+	def __init__(self, directory, url, min_time=MIN_TIME, repeat=REPEAT, only=None):
+		""" Temporary files go in directory and HTTP requests to url. With
+		only, just the benchmarks named in it are run. """
+		self.directory = directory
+		self.url = url
+		self.only = only
+		self.min_time = min_time
+		self.repeat = repeat
+		self.session = network.new_session()
+		self.rng = np.random.default_rng(1)
+		self.queries = 0
+
+	def run(self, name, n, fn):
+		""" Result dict, or None if name isn't wanted """
+		if self.only and name not in self.only:
+			return None
+		result = {'name': name, 'points': n}
+		result.update(measure(fn, self.min_time, self.repeat))
+		return result
+
+	def track_benchmarks(self, n):
+		""" Yields the results for a track of n points """
+		track = synthetic_track(n)
+		# Mouse positions a few metres off random vertices
+		pick = self.rng.integers(0, n, LOOKUPS)
+		clicks = np.column_stack((track.lat[pick] + self.rng.normal(0, 2e-5, LOOKUPS), track.lon[pick] + self.rng.normal(0, 2e-5, LOOKUPS))).tolist()
+		along = (self.rng.random(LOOKUPS) * track.length).tolist()
+		path = os.path.join(self.directory, 'bench.gpx')
+
+		def cumulative_distance():
+			geometry.cumulative_distance(track.lat, track.lon)
+			return 1
+
+		def gpx_write():
+			gpxio.write(path, *track.columns())
+			return 1
+
+		def gpx_parse():
+			# As read_gpx() does
+			if not os.path.exists(path):
+				gpx_write()
+			Track.from_latlon(gpxio.read(path).points())
+			return 1
+
+		def hover():
+			# As the elevation chart does on each mouse move
+			for d in along:
+				track.locate(d)
+			return len(along)
+
+		def index_build():
+			# As ors_result() does for every new route
+			GridIndex.from_arrays(track.lat, track.lon)
+			return 1
+
+		index = None
+
+		def nearest_vertex():
+			# As edit() does to place a dragged point
+			nonlocal index
+			if index is None:
+				index = GridIndex.from_arrays(track.lat, track.lon)
+			longest = float(np.diff(track.dist).max())
+			for pt in clicks:
+				nearest_on_track(index, track.lat, track.lon, pt, longest)
+			return len(clicks)
+
+		yield self.run('cumulative_distance', n, cumulative_distance)
+		yield self.run('gpx_write', n, gpx_write)
+		yield self.run('gpx_parse', n, gpx_parse)
+		yield self.run('hover', n, hover)
+		yield self.run('index_build', n, index_build)
+		yield self.run('nearest_vertex', n, nearest_vertex)
+		if os.path.exists(path):
+			os.remove(path)
+
+	def route_benchmarks(self, n):
+		""" Yields the results for a route and an elevation profile of about n points """
+		# Due north far enough for n points at the stand-in's spacing
+		span = n * 10 / 111195
+		body = {"coordinates": [[-0.1, 51.5], [-0.1, 51.5 + span]], "elevation": "true", "preference": "fastest"}
+		track = synthetic_track(n)
+		line = {"format_in": "polyline", "format_out": "polyline", "geometry": np.column_stack((track.lon, track.lat)).tolist()}
+
+		def ors_directions():
+			# As ors_fetch() and ors_result() do
+			r = self.session.post(self.url + '/v2/directions/driving-car/geojson', json=body, timeout=network.TIMEOUT)
+			r.raise_for_status()
+			route_json = json.loads(r.content)
+			points = Track.from_lonlat(route_json['features'][0]['geometry']['coordinates'])
+			GridIndex.from_arrays(points.lat, points.lon)
+			return 1
+
+		def ors_elevation():
+			# As elevation() does
+			r = self.session.post(self.url + '/elevation/line', json=line, timeout=network.TIMEOUT)
+			r.raise_for_status()
+			Track.from_lonlat(json.loads(r.text)['geometry'])
+			return 1
+
+		yield self.run('ors_directions', n, ors_directions)
+		yield self.run('ors_elevation', n, ors_elevation)
+
+	def geocode_benchmarks(self):
+		""" Yields the results for Nominatim searches fetched and from the cache """
+		cache = Cache(os.path.join(self.directory, 'nominatim.sqlite'))
+		geocoder = Geocoder(cache, rate=1e9, url=self.url)
+		done = []
+
+		def fetch():
+			# New queries each run so none come from the cache
+			done[:] = ['%d Bench Street' % (self.queries + i) for i in range(GEOCODES)]
+			self.queries = self.queries + GEOCODES
+			for q in done:
+				geocoder.search(q)
+			return GEOCODES
+
+		def cached():
+			for q in done:
+				geocoder.search(q)
+			return GEOCODES
+
+		def reverse():
+			for i in range(GEOCODES):
+				self.queries = self.queries + 1
+				geocoder.reverse(51.5 + self.queries * 1e-4, -0.1)
+			return GEOCODES
+
+		yield self.run('geocode_search', None, fetch)
+		if not done:
+			fetch()
+		yield self.run('geocode_cached', None, cached)
+		yield self.run('geocode_reverse', None, reverse)
+		cache.close()
+
+def machine():
+	""" What the results were measured on """
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+			capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		'commit': commit,
+		'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+	}
+
+def compare(results, old):
+	""" Prints each result's time against the same one in an earlier run """
+	before = {(r['name'], r['points']): r['per_op'] for r in old['results']}
+	print('%-20s %9s %12s %12s %7s' % ('', 'points', 'before', 'after', 'ratio'), file=sys.stderr)
+	for r in results:
+		was = before.get((r['name'], r['points']))
+		if was is None:
+			continue
+		print('%-20s %9s %12.6f %12.6f %7.2f' % (r['name'], r['points'] or '', was, r['per_op'], r['per_op'] / was), file=sys.stderr)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Time the map\'s track, GPX, routing and geocoding code')
+	parser.add_argument('-o', '--output', help='JSON results, default standard output')
+	parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='track points')
+	parser.add_argument('--only', nargs='+', help='benchmark names to run')
+	parser.add_argument('--min-time', type=float, default=MIN_TIME)
+	parser.add_argument('--repeat', type=int, default=REPEAT)
+	parser.add_argument('--compare', help='earlier results to compare with')
+	args = parser.parse_args(argv)
+
+	server = StandIns().start()
+	results = []
+	with tempfile.TemporaryDirectory() as directory:
+		bench = Bench(directory, server.url, args.min_time, args.repeat, args.only)
+		groups = [bench.track_benchmarks(n) for n in args.sizes]
+		groups = groups + [bench.route_benchmarks(n) for n in args.sizes if n <= ROUTE_MAX]
+		groups.append(bench.geocode_benchmarks())
+		try:
+			for group in groups:
+				for result in group:
+					if result is None:
+						continue
+					results.append(result)
+					print('%-20s %9s %3d runs %10.6f s' % (result['name'], result['points'] or '', result['runs'], result['per_op']), file=sys.stderr)
+		finally:
+			server.shutdown()
+
+	output = json.dumps({'machine': machine(), 'results': results}, indent=1)
+	if args.output:
+		with open(args.output, 'w') as f:
+			f.write(output + '\n')
+	else:
+		print(output)
+	if args.compare:
+		with open(args.compare) as f:
+			compare(results, json.load(f))
+
+if __name__ == '__main__':
+	main()
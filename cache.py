@@ -0,0 +1,139 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Small SQLite key/value cache with expiry and least-recently-used pruning """
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DAY = 86400
+
+def cache_dir():
+	""" ~/.cache/donmaps, or under $XDG_CACHE_HOME """
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	path = os.path.join(base, 'donmaps')
+	os.makedirs(path, exist_ok=True)
+	return path
+
+class Cache:
+	def __init__(self, path, ttl=30 * DAY, max_entries=20000, max_bytes=50 * 1024 * 1024):
+		""" Entries older than ttl seconds are only returned with stale=True.
+		Beyond max_entries or max_bytes the least recently used go first. """
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.puts = 0
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL)')
+		self.db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+		self.db.commit()
+
+	def get(self, key, stale=False):
+		""" Cached value or None. stale=True also returns expired entries, e.g. when offline """
+		now = time.time()
+		with self.lock:
+			row = self.db.execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+			if row is None or (not stale and now - row[1] > self.ttl):
+				return None
+			self.db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+			self.db.commit()
+		return row[0]
+
+	def __contains__(self, key):
+		""" True if there is an unexpired entry. Unlike get() it doesn't count as a use. """
+		with self.lock:
+			row = self.db.execute('SELECT created FROM cache WHERE key = ?', (key,)).fetchone()
+		return row is not None and time.time() - row[0] <= self.ttl
+
+	def put(self, key, value):
+		now = time.time()
+		with self.lock:
+			self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, value, now, now))
+			self.db.commit()
+			self.puts = self.puts + 1
+			if self.puts % 100 == 1:
+				self.prune()
+
+	def prune(self):
+		""" Drops least recently used entries until within both limits. Call with lock held. """
+		count, size = self.db.execute('SELECT COUNT(*), TOTAL(LENGTH(value)) FROM cache').fetchone()
+		if count <= self.max_entries and size <= self.max_bytes:
+			return
+		rows = self.db.execute('SELECT key, LENGTH(value) FROM cache ORDER BY accessed')
+		drop = []
+		for key, length in rows:
+			if count <= self.max_entries and size <= self.max_bytes:
+				break
+			drop.append((key,))
+			count = count - 1
+			size = size - (length or 0)
+		self.db.executemany('DELETE FROM cache WHERE key = ?', drop)
+		self.db.commit()
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+class MemoryCache:
+	""" Least-recently-used dict in front of a Cache, for values wanted again within seconds """
+	def __init__(self, disk, size=32):
+		self.disk = disk
+		self.size = size
+		self.items = OrderedDict()
+
+	def get(self, key, stale=False):
+		try:
+			self.items.move_to_end(key)
+			return self.items[key]
+		except KeyError:
+			pass
+		value = self.disk.get(key, stale)
+		if value is not None:
+			self.remember(key, value)
+		return value
+
+	def put(self, key, value):
+		self.remember(key, value)
+		self.disk.put(key, value)
+
+	def remember(self, key, value):
+		self.items[key] = value
+		self.items.move_to_end(key)
+		while len(self.items) > self.size:
+			self.items.popitem(last=False)
+
+	def __contains__(self, key):
+		return key in self.items or key in self.disk
+
+	def close(self):
+		self.disk.close()
+
+def search_key(query):
+	""" Search text with case and spacing normalised """
+	return 'search:' + ' '.join(query.lower().split())
+
+def reverse_key(lat, lon):
+	""" Points within about a metre share a key """
+	return 'reverse:%.5f,%.5f' % (float(lat), float(lon))
+
+def route_key(profile, pref, coords):
+	""" ORS route for a profile, preference and [lon, lat] list """
+	return 'route:%s:%s:' % (profile, pref) + ';'.join('%.6f,%.6f' % (c[0], c[1]) for c in coords)
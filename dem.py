@@ -0,0 +1,97 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Elevations from SRTM .hgt files, without the network """
+
+import math
+import os
+from collections import OrderedDict
+import numpy as np
+
+# Marks a hole in SRTM data
+VOID = -32768
+
+def tile_name(lat, lon):
+	""" e.g. N50W006 for the tile whose south west corner is at 50, -6 """
+	return '%s%02d%s%03d' % ('N' if lat >= 0 else 'S', abs(lat), 'E' if lon >= 0 else 'W', abs(lon))
+
+class DEM:
+	def __init__(self, directory, tiles=16):
+		""" .hgt files in directory, any case, are found by name. Up to tiles of
+		them are kept memory mapped, least recently used closed first. """
+		self.size = tiles
+		self.files = {}
+		for name in os.listdir(directory):
+			stem, ext = os.path.splitext(name)
+			if ext.lower() == '.hgt':
+				self.files[stem.upper()] = os.path.join(directory, name)
+		self.tiles = OrderedDict()
+
+	def __len__(self):
+		return len(self.files)
+
+	def tile(self, lat, lon):
+		""" Square int16 array of the 1 degree tile, or None if there's no file """
+		key = (lat, lon)
+		try:
+			self.tiles.move_to_end(key)
+			return self.tiles[key]
+		except KeyError:
+			pass
+		path = self.files.get(tile_name(lat, lon))
+		if path is None:
+			data = None
+		else:
+			# 1201 square for 3 arc second data, 3601 for 1 arc second
+			n = int(math.isqrt(os.path.getsize(path) // 2))
+			data = np.memmap(path, dtype='>i2', mode='r', shape=(n, n))
+		self.tiles[key] = data
+		while len(self.tiles) > self.size:
+			self.tiles.popitem(last=False)
+		return data
+
+	def sample(self, lat, lon):
+		""" Bilinear elevations at each point. NaN where there's no tile or a void. """
+		lat = np.asarray(lat, dtype=float)
+		lon = np.asarray(lon, dtype=float)
+		ele = np.full(len(lat), np.nan)
+		south = np.floor(lat).astype(int)
+		west = np.floor(lon).astype(int)
+		keys, inverse = np.unique((south + 90) * 360 + west + 180, return_inverse=True)
+		for k, key in enumerate(keys.tolist()):
+			s = key // 360 - 90
+			w = key % 360 - 180
+			data = self.tile(s, w)
+			if data is None:
+				continue
+			idx = np.flatnonzero(inverse == k)
+			n = data.shape[0]
+			# Row 0 is the north edge
+			row = (s + 1 - lat[idx]) * (n - 1)
+			col = (lon[idx] - w) * (n - 1)
+			r = np.clip(np.floor(row).astype(int), 0, n - 2)
+			c = np.clip(np.floor(col).astype(int), 0, n - 2)
+			fr = row - r
+			fc = col - c
+			z00 = data[r, c].astype(float)
+			z01 = data[r, c + 1].astype(float)
+			z10 = data[r + 1, c].astype(float)
+			z11 = data[r + 1, c + 1].astype(float)
+			z = (z00 * (1 - fc) + z01 * fc) * (1 - fr) + (z10 * (1 - fc) + z11 * fc) * fr
+			void = (z00 == VOID) | (z01 == VOID) | (z10 == VOID) | (z11 == VOID)
+			z[void] = np.nan
+			ele[idx] = z
+		return ele
@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Nominatim search and reverse geocoding, and batch geocoding of CSV files
+
+	python3 geocode.py search addresses.csv out.csv --column address
+	python3 geocode.py reverse points.csv out.csv --lat lat --lon lon
+
+Rows are read and written as they go, in order, with results found in the
+cache used first. Requests start at most --rate a second, the public
+server's limit being 1. When the server says it's busy (429 or 5xx) or
+can't be reached, requests wait as long as it asks, or back off, and try
+again. If it still fails, the run stops after the last row it could do.
+Interrupted or stopped runs carry on from the checkpoint file
+(out.csv.checkpoint) when started again with the same arguments.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import network
+from cache import Cache, cache_dir, search_key, reverse_key
+
+NOMINATIM_URL = os.environ.get('DONMAPS_NOMINATIM') or 'https://nominatim.openstreetmap.org'
+# Requests a second the public server allows
+RATE = 1.0
+RESULT_COLUMNS = ['geocode_name', 'geocode_lat', 'geocode_lon']
+# Replies worth trying again after a wait
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Tries after the first, waiting BACKOFF seconds, doubling, unless told how long
+RETRIES = 5
+BACKOFF = 1
+# Longer than this is given up on rather than waited for
+MAX_WAIT = 300
+
+class Unavailable(Exception):
+	""" The server was busy or unreachable however many times it was asked """
+
+def retry_after(response):
+	""" Seconds a Retry-After header asks for, or None """
+	value = response.headers.get('Retry-After')
+	if value is None:
+		return None
+	try:
+		return max(float(value), 0)
+	except ValueError:
+		pass
+	try:
+		return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+	except (TypeError, ValueError):
+		return None
+
+def search_url(query, limit=8, url=NOMINATIM_URL):
+	return url + '/?format=json&addressdetails=1&q=' + quote(query) + '&format=json&limit=' + str(limit)
+
+def reverse_url(lat, lon, url=NOMINATIM_URL):
+	return url + '/?addressdetails=1&q=' + str(lat) + ',' + str(lon) + '&format=json&limit=1'
+
+def cache_path():
+	return os.path.join(cache_dir(), 'nominatim.sqlite')
+
+class TokenBucket:
+	""" Lets callers through at rate a second on average, up to burst at once """
+	def __init__(self, rate=RATE, burst=1):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.last = time.monotonic()
+		self.lock = threading.Lock()
+
+	def take(self):
+		""" Blocks until a token is free """
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+				self.last = now
+				if self.tokens >= 1:
+					self.tokens = self.tokens - 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+	def pause(self, seconds):
+		""" Holds everyone up for seconds, as when the server asks for a break """
+		with self.lock:
+			self.last = time.monotonic()
+			self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class Geocoder:
+	def __init__(self, cache, rate=RATE, url=NOMINATIM_URL):
+		""" Blocking lookups, safe to call from several threads. Responses are
+		cached, and expired ones still used if the server can't be reached. """
+		self.cache = cache
+		self.url = url
+		self.bucket = TokenBucket(rate)
+		self.local = threading.local()
+		self.hits = 0
+		self.fetches = 0
+
+	def session(self):
+		try:
+			return self.local.session
+		except AttributeError:
+			session = self.local.session = network.new_session()
+			return session
+
+	def get(self, url, key):
+		""" Parsed JSON response. Raises Unavailable if the server stays busy
+		or out of reach and nothing is cached, and the error for other failures. """
+		content = self.cache.get(key)
+		if content is not None:
+			self.hits = self.hits + 1
+			return json.loads(content)
+		try:
+			content = self.fetch(url)
+		except Exception:
+			content = self.cache.get(key, stale=True)
+			if content is None:
+				raise
+			return json.loads(content)
+		self.cache.put(key, content)
+		return json.loads(content)
+
+	def fetch(self, url):
+		""" Response body, trying again while the server is busy or unreachable """
+		for attempt in range(RETRIES + 1):
+			self.bucket.take()
+			self.fetches = self.fetches + 1
+			wait = BACKOFF * 2 ** attempt
+			try:
+				r = self.session().get(url, timeout=network.TIMEOUT)
+			except Exception as e:
+				error = e
+			else:
+				if r.status_code not in RETRY_STATUS:
+					r.raise_for_status()
+					return r.content
+				error = 'HTTP %d' % r.status_code
+				wait = retry_after(r) or wait
+				if wait > MAX_WAIT:
+					break
+			if attempt < RETRIES:
+				# Slows every worker, not just this one
+				self.bucket.pause(wait)
+		raise Unavailable(str(error))
+
+	def search(self, query):
+		""" Places matching query, best first """
+		return self.get(search_url(query, 8, self.url), search_key(query))
+
+	def reverse(self, lat, lon):
+		""" What's at lat, lon, as a list of at most one place """
+		return self.get(reverse_url(lat, lon, self.url), reverse_key(lat, lon))
+
+def result_row(places):
+	if not places:
+		return ['', '', '']
+	return [places[0].get('display_name', ''), places[0].get('lat', ''), places[0].get('lon', '')]
+
+def batch(geocoder, rows, lookup, workers=2, window=64):
+	""" Yields (row, result columns) in input order, with up to window rows
+	in hand across workers threads """
+	pool = ThreadPoolExecutor(max_workers=workers)
+	pending = deque()
+
+	def run(row):
+		try:
+			return result_row(lookup(geocoder, row))
+		except Unavailable:
+			# Not written, so the row is tried again on the next run
+			raise
+		except Exception as e:
+			return ['ERROR: %s' % e, '', '']
+
+	try:
+		for row in rows:
+			pending.append((row, pool.submit(run, row)))
+			if len(pending) >= window:
+				row, future = pending.popleft()
+				yield row, future.result()
+		while pending:
+			row, future = pending.popleft()
+			yield row, future.result()
+	finally:
+		for row, future in pending:
+			future.cancel()
+		pool.shutdown(wait=False)
+
+def save(checkpoint, n, outfile):
+	""" Records that n rows are in outfile, written out to disk """
+	outfile.flush()
+	os.fsync(outfile.fileno())
+	with open(checkpoint + '.part', 'w') as f:
+		f.write('%d %d' % (n, outfile.tell()))
+	os.replace(checkpoint + '.part', checkpoint)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Geocode a CSV file with Nominatim')
+	parser.add_argument('mode', choices=('search', 'reverse'))
+	parser.add_argument('input')
+	parser.add_argument('output')
+	parser.add_argument('--column', default='address', help='address column for search')
+	parser.add_argument('--lat', default='lat', help='latitude column for reverse')
+	parser.add_argument('--lon', default='lon', help='longitude column for reverse')
+	parser.add_argument('--workers', type=int, default=2)
+	parser.add_argument('--rate', type=float, default=RATE, help='most requests a second')
+	parser.add_argument('--url', default=NOMINATIM_URL)
+	parser.add_argument('--checkpoint', help='default OUTPUT.checkpoint')
+	args = parser.parse_args(argv)
+
+	if args.mode == 'search':
+		lookup = lambda geocoder, row: geocoder.search(row[args.column])
+	else:
+		lookup = lambda geocoder, row: geocoder.reverse(float(row[args.lat]), float(row[args.lon]))
+	checkpoint = args.checkpoint or args.output + '.checkpoint'
+	# Rows done and the length of the output file after them
+	done = 0
+	if os.path.exists(checkpoint) and os.path.exists(args.output):
+		with open(checkpoint) as f:
+			done, size = map(int, f.read().split())
+		# Drop anything written after the checkpoint
+		with open(args.output, 'r+b') as f:
+			f.truncate(size)
+
+	cache = Cache(cache_path())
+	geocoder = Geocoder(cache, args.rate, args.url)
+	start = time.monotonic()
+	shown = 0
+	n = done
+	with open(args.input, newline='', encoding='utf-8') as infile, \
+		open(args.output, 'a' if done else 'w', newline='', encoding='utf-8') as outfile:
+		reader = csv.DictReader(infile)
+		writer = csv.writer(outfile)
+		if not done:
+			writer.writerow(reader.fieldnames + RESULT_COLUMNS)
+		# Rows done in an earlier run are skipped
+		rows = (row for i, row in enumerate(reader) if i >= done)
+		stopped = None
+		try:
+			for row, result in batch(geocoder, rows, lookup, args.workers):
+				writer.writerow([row[k] for k in reader.fieldnames] + result)
+				n = n + 1
+				now = time.monotonic()
+				if now - shown >= 1:
+					save(checkpoint, n, outfile)
+					shown = now
+					print('\r%d rows, %d from cache, %d fetched, %.0f s' % (n, geocoder.hits, geocoder.fetches, now - start), end='', file=sys.stderr)
+		except Unavailable as e:
+			stopped = e
+		finally:
+			save(checkpoint, n, outfile)
+			cache.close()
+	print('\r%d rows, %d from cache, %d fetched, %.0f s' % (n, geocoder.hits, geocoder.fetches, time.monotonic() - start), file=sys.stderr)
+	if stopped is not None:
+		sys.exit('Stopped at row %d, server unavailable (%s). Run again to carry on.' % (n + 1, stopped))
+	os.remove(checkpoint)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,105 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Haversine geometry over whole coordinate arrays """
+
+import numpy as np
+
+EARTH_RADIUS = 6378137
+RAD = np.pi / 180
+
+def haversine(lat1, lon1, lat2, lon2):
+	""" Element-wise distance in metres between two sets of points """
+	lat1 = np.asarray(lat1, dtype=float) * RAD
+	lat2 = np.asarray(lat2, dtype=float) * RAD
+	sinDLat = np.sin((lat2 - lat1) / 2)
+	sinDLon = np.sin((np.asarray(lon2, dtype=float) - np.asarray(lon1, dtype=float)) * RAD / 2)
+	a = sinDLat * sinDLat + np.cos(lat1) * np.cos(lat2) * sinDLon * sinDLon
+	return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def distance(latlng1, latlng2):
+	""" Distance in metres between two (lat, lon) points """
+	return float(haversine(latlng1[0], latlng1[1], latlng2[0], latlng2[1]))
+
+def segment_lengths(lat, lon):
+	""" Length of each segment of a polyline, one shorter than the input """
+	lat = np.asarray(lat, dtype=float)
+	lon = np.asarray(lon, dtype=float)
+	return haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+def cumulative_distance(lat, lon):
+	""" Distance along a polyline at each vertex, starting at 0 """
+	d = np.zeros(len(lat))
+	if len(d) > 1:
+		np.cumsum(segment_lengths(lat, lon), out=d[1:])
+	return d
+
+def bbox(lat, lon):
+	""" (lat_min, lat_max, lon_min, lon_max), the order zoom_fit_bbox() takes """
+	lat = np.asarray(lat, dtype=float)
+	lon = np.asarray(lon, dtype=float)
+	return float(np.nanmin(lat)), float(np.nanmax(lat)), float(np.nanmin(lon)), float(np.nanmax(lon))
+
+def nearest_vertex(lat, lon, pt):
+	""" Index of and distance to the vertex nearest pt (lat, lon) """
+	d = haversine(lat, lon, pt[0], pt[1])
+	if len(d) == 0:
+		return None, float('inf')
+	i = int(np.argmin(d))
+	return i, float(d[i])
+
+def nearest_on_polyline(lat, lon, pt):
+	""" Nearest position on a polyline to pt (lat, lon).
+
+	Returns (segment index, fraction along that segment, distance in metres).
+	Segments are projected onto a local flat plane centred on pt, which is
+	plenty accurate for picking a segment under the mouse.
+	"""
+	lat = np.asarray(lat, dtype=float)
+	lon = np.asarray(lon, dtype=float)
+	if len(lat) < 2:
+		i, d = nearest_vertex(lat, lon, pt)
+		return i, 0.0, d
+	k = np.cos(pt[0] * RAD)
+	y = (lat - pt[0]) * RAD * EARTH_RADIUS
+	x = (lon - pt[1]) * RAD * EARTH_RADIUS * k
+	dx = x[1:] - x[:-1]
+	dy = y[1:] - y[:-1]
+	l2 = dx * dx + dy * dy
+	with np.errstate(invalid='ignore', divide='ignore'):
+		t = np.where(l2 > 0, -(x[:-1] * dx + y[:-1] * dy) / l2, 0)
+	t = np.clip(t, 0, 1)
+	px = x[:-1] + t * dx
+	py = y[:-1] + t * dy
+	i = int(np.argmin(px * px + py * py))
+	plat = lat[i] + t[i] * (lat[i + 1] - lat[i])
+	plon = lon[i] + t[i] * (lon[i + 1] - lon[i])
+	return i, float(t[i]), distance(pt, (plat, plon))
+
+def position_at(cum, d):
+	""" Segment index i and fraction t where distance d falls along a polyline.
+
+	cum is the array from cumulative_distance(); the lookup is a binary
+	search so it is cheap enough to run on every mouse move.
+	"""
+	n = len(cum)
+	if n < 2:
+		return 0, 0.0
+	i = int(np.searchsorted(cum, d, side='right')) - 1
+	i = min(max(i, 0), n - 2)
+	seg = cum[i + 1] - cum[i]
+	t = (d - cum[i]) / seg if seg > 0 else 0.0
+	return i, float(min(max(t, 0.0), 1.0))
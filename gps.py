@@ -0,0 +1,149 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" gpsd client on the GLib main loop """
+
+import calendar
+import errno
+import json
+import socket
+import time
+from gi.repository import GLib
+
+HOST = '127.0.0.1'
+PORT = 2947
+WATCH = b'?WATCH={"enable":true,"json":true};\n'
+UNWATCH = b'?WATCH={"enable":false};\n'
+# Seconds between reconnection attempts, doubling up to the most
+BACKOFF = 1
+MAX_BACKOFF = 30
+
+def fix_time(tpv):
+	""" Seconds since the epoch of a TPV report, or now if it has no time """
+	try:
+		return calendar.timegm(time.strptime(tpv['time'][:19], '%Y-%m-%dT%H:%M:%S')) + float('0' + tpv['time'][19:].rstrip('Z'))
+	except (KeyError, ValueError):
+		return time.time()
+
+class GpsClient:
+	def __init__(self, on_fix, on_status=None, host=HOST, port=PORT):
+		""" Keeps one connection to gpsd in watch mode. on_fix(tpv) gets each
+		TPV report with a position, as a dict, and on_status(connected) is
+		called when the connection comes or goes. """
+		self.on_fix = on_fix
+		self.on_status = on_status
+		self.host = host
+		self.port = port
+		self.sock = None
+		self.watch = None
+		self.retry = None
+		self.backoff = BACKOFF
+		self.buffer = b''
+		self.running = False
+		self.up = False
+
+	def start(self):
+		self.running = True
+		self.connect()
+
+	def stop(self):
+		""" Closes the connection and stops trying to reconnect """
+		self.running = False
+		if self.retry is not None:
+			GLib.source_remove(self.retry)
+			self.retry = None
+		if self.sock is not None:
+			try:
+				self.sock.send(UNWATCH)
+			except OSError:
+				pass
+		self.close()
+
+	def connect(self):
+		""" Starts a non-blocking connect, finished in opened() """
+		self.retry = None
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setblocking(False)
+		err = self.sock.connect_ex((self.host, self.port))
+		if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+			self.lost()
+			return GLib.SOURCE_REMOVE
+		self.watch = GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_OUT | GLib.IO_HUP | GLib.IO_ERR, self.opened)
+		return GLib.SOURCE_REMOVE
+
+	def opened(self, fd, condition):
+		self.watch = None
+		if condition & (GLib.IO_HUP | GLib.IO_ERR) or self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+			self.lost()
+			return GLib.SOURCE_REMOVE
+		try:
+			self.sock.send(WATCH)
+		except OSError:
+			self.lost()
+			return GLib.SOURCE_REMOVE
+		self.buffer = b''
+		self.watch = GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.readable)
+		self.up = True
+		if self.on_status is not None:
+			self.on_status(True)
+		return GLib.SOURCE_REMOVE
+
+	def readable(self, fd, condition):
+		""" Reads whatever has arrived and passes on each complete report """
+		try:
+			data = self.sock.recv(65536)
+		except BlockingIOError:
+			return GLib.SOURCE_CONTINUE
+		except OSError:
+			data = b''
+		if not data:
+			self.watch = None
+			self.lost()
+			return GLib.SOURCE_REMOVE
+		self.backoff = BACKOFF
+		lines = (self.buffer + data).split(b'\n')
+		self.buffer = lines.pop()
+		for line in lines:
+			self.report(line)
+		return GLib.SOURCE_CONTINUE
+
+	def report(self, line):
+		try:
+			report = json.loads(line)
+		except ValueError:
+			return
+		# mode 2 and 3 are 2D and 3D fixes
+		if report.get('class') == 'TPV' and report.get('mode', 0) >= 2 and 'lat' in report and 'lon' in report:
+			self.on_fix(report)
+
+	def lost(self):
+		""" Tries again later, waiting longer each time it fails """
+		was_up = self.up
+		self.close()
+		if self.on_status is not None and was_up:
+			self.on_status(False)
+		if self.running:
+			self.retry = GLib.timeout_add_seconds(self.backoff, self.connect)
+			self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+	def close(self):
+		self.up = False
+		if self.watch is not None:
+			GLib.source_remove(self.watch)
+			self.watch = None
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
@@ -0,0 +1,274 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Streaming GPX reading and writing, without building a document tree """
+
+import os
+import time
+from datetime import datetime, timezone
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+import numpy as np
+import simplify
+
+POINTS = {'trkpt': 'tracks', 'rtept': 'routes', 'wpt': 'waypoints'}
+# Elements that start a new run of points
+SEGMENTS = {'trkseg': 'tracks', 'rte': 'routes'}
+# Rough size of a <trkpt> in bytes, for sizing the arrays up front
+BYTES_PER_POINT = 80
+PROGRESS_EVERY = 20000
+# Points formatted and written at a time
+WRITE_CHUNK = 10000
+
+HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1"  creator="DonMaps" version="1.1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd">\n<trk>\n<name>%s</name>\n<trkseg>\n'
+FOOTER = '</trkseg>\n</trk>\n</gpx>\n'
+
+class StopReading(Exception):
+	pass
+
+class Points:
+	""" Growable n x 3 float array of lat, lon, ele (NaN where there is none),
+	or n x 4 with times as well """
+	def __init__(self, capacity, columns=3):
+		self.data = np.empty((max(capacity, 16), columns))
+		self.n = 0
+
+	def append(self, pt):
+		if self.n == len(self.data):
+			self.data = np.resize(self.data, (2 * len(self.data), self.data.shape[1]))
+		self.data[self.n] = pt
+		self.n = self.n + 1
+
+	def array(self):
+		return self.data[:self.n]
+
+class GPX:
+	""" tracks, routes and waypoints as n x 3 arrays of lat, lon, ele """
+	def __init__(self, tracks, routes, waypoints, complete=True, track_times=None, starts=None):
+		self.tracks = tracks
+		self.routes = routes
+		self.waypoints = waypoints
+		# False if reading stopped at max_points
+		self.complete = complete
+		# Seconds since the epoch of each track point, NaN for none, if asked for
+		self.track_times = track_times
+		# {'tracks': [...], 'routes': [...]}, where each <trkseg> and <rte> begins
+		self.starts = starts or {}
+
+	def points(self):
+		""" Everything in the order load_gpx() has always used """
+		return np.concatenate((self.tracks, self.waypoints, self.routes))
+
+	def segments(self, kind='tracks'):
+		""" Slices of the tracks or routes array, one per non-empty <trkseg> or <rte> """
+		n = len(getattr(self, kind))
+		edges = sorted(set([0] + [i for i in self.starts.get(kind, ()) if i < n])) + [n]
+		return [slice(a, b) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+def local(tag):
+	""" Tag without its namespace """
+	return tag.rpartition('}')[2]
+
+def parse_time(text):
+	""" Seconds since the epoch of an ISO 8601 time, taken as UTC if it has no zone """
+	t = datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+	if t.tzinfo is None:
+		t = t.replace(tzinfo=timezone.utc)
+	return t.timestamp()
+
+class Reader:
+	""" expat handlers filling Points as the file streams past """
+	def __init__(self, f, size, progress, max_points, bbox, times=False):
+		capacity = size // BYTES_PER_POINT
+		if max_points is not None:
+			capacity = min(capacity, max_points)
+		columns = 4 if times else 3
+		self.arrays = {'tracks': Points(capacity, columns), 'routes': Points(16, columns), 'waypoints': Points(16, columns)}
+		self.starts = {'tracks': [], 'routes': []}
+		# Child elements of a point whose text is read
+		self.values = {'ele': 2, 'time': 3} if times else {'ele': 2}
+		self.columns = columns
+		self.f = f
+		self.size = size
+		self.progress = progress
+		self.max_points = max_points
+		self.bbox = bbox
+		self.kinds = {}
+		self.point = None
+		self.text = None
+		self.kept = 0
+		self.seen = 0
+
+	def kind(self, name):
+		try:
+			return self.kinds[name]
+		except KeyError:
+			tag = local(name)
+			if tag in self.values or tag in SEGMENTS:
+				kind = tag
+			else:
+				kind = POINTS.get(tag)
+			self.kinds[name] = kind
+			return kind
+
+	def start(self, name, attrs):
+		kind = self.kind(name)
+		if kind is None:
+			return
+		if kind in self.values:
+			if self.point is not None:
+				self.text = []
+			return
+		if kind in SEGMENTS:
+			self.starts[SEGMENTS[kind]].append(self.arrays[SEGMENTS[kind]].n)
+			return
+		try:
+			self.point = [float(attrs['lat']), float(attrs['lon'])] + [np.nan] * (self.columns - 2)
+		except (KeyError, ValueError):
+			self.point = None
+
+	def data(self, text):
+		if self.text is not None:
+			self.text.append(text)
+
+	def end(self, name):
+		kind = self.kind(name)
+		if kind is None:
+			return
+		if kind in self.values:
+			if self.text is not None and self.point is not None:
+				try:
+					text = ''.join(self.text)
+					self.point[self.values[kind]] = float(text) if kind == 'ele' else parse_time(text)
+				except ValueError:
+					pass
+			self.text = None
+			return
+		if kind in SEGMENTS:
+			return
+
+		self.seen = self.seen + 1
+		pt = self.point
+		self.point = None
+		bbox = self.bbox
+		if pt is not None and (bbox is None or (bbox[0] <= pt[0] <= bbox[1] and bbox[2] <= pt[1] <= bbox[3])):
+			self.arrays[kind].append(pt)
+			self.kept = self.kept + 1
+		if self.progress is not None and self.seen % PROGRESS_EVERY == 0:
+			self.progress(self.f.tell() / self.size)
+		if self.max_points is not None and self.kept >= self.max_points:
+			raise StopReading
+
+def read(path, progress=None, max_points=None, bbox=None, times=False):
+	""" Reads the points of a GPX file incrementally.
+
+	progress(fraction) is called every PROGRESS_EVERY points. Reading stops
+	once max_points have been kept. With bbox (lat_min, lat_max, lon_min,
+	lon_max) only points inside it are kept. times=True also reads track
+	point times into GPX.track_times.
+	"""
+	size = max(os.path.getsize(path), 1)
+	complete = True
+	with open(path, 'rb') as f:
+		reader = Reader(f, size, progress, max_points, bbox, times)
+		parser = expat.ParserCreate(namespace_separator='}')
+		parser.StartElementHandler = reader.start
+		parser.EndElementHandler = reader.end
+		parser.CharacterDataHandler = reader.data
+		parser.buffer_text = True
+		try:
+			parser.ParseFile(f)
+		except StopReading:
+			complete = False
+
+	if progress is not None:
+		progress(1.0)
+	tracks, routes, waypoints = (reader.arrays[k].array() for k in ('tracks', 'routes', 'waypoints'))
+	if not times:
+		return GPX(tracks, routes, waypoints, complete, starts=reader.starts)
+	return GPX(tracks[:,:3], routes[:,:3], waypoints[:,:3], complete, tracks[:,3], reader.starts)
+
+def iso_time(t):
+	""" GPX time for seconds since the epoch """
+	return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+def trkpts(lat, lon, ele=None, precision=None, times=None):
+	""" <trkpt> lines for one chunk of points. precision is decimal places
+	for lat and lon, or None for as many as it takes. times are seconds since
+	the epoch, NaN for none. """
+	lat = np.asarray(lat, dtype=float).tolist()
+	lon = np.asarray(lon, dtype=float).tolist()
+	if precision is None:
+		pos = ['<trkpt lat="%r" lon="%r">' % p for p in zip(lat, lon)]
+	else:
+		pos = ['<trkpt lat="%.*f" lon="%.*f">' % (precision, a, precision, b) for a, b in zip(lat, lon)]
+	if ele is None and times is None:
+		return '</trkpt>\n'.join(pos) + '</trkpt>\n' if pos else ''
+	if ele is None:
+		eles = [''] * len(pos)
+	else:
+		eles = ['<ele>%r</ele>' % e if e == e else '' for e in np.asarray(ele, dtype=float).tolist()]
+	if times is None:
+		return ''.join(p + e + '</trkpt>\n' for p, e in zip(pos, eles))
+	times = ['<time>%s</time>' % iso_time(t) if t == t else '' for t in np.asarray(times, dtype=float).tolist()]
+	return ''.join(p + e + t + '</trkpt>\n' for p, e, t in zip(pos, eles, times))
+
+def write_chunks(path, chunks, name='GPX Track', precision=None, progress=None):
+	""" Writes a one segment track from an iterable of (lat, lon, ele) or
+	(lat, lon, ele, times) array chunks, ele may be None. Goes to a .part
+	file renamed into place at the end, so a failed save never leaves half a
+	file. progress(n) gets the number of points written so far. """
+	part = path + '.part'
+	n = 0
+	try:
+		with open(part, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+			f.write(HEADER % escape(name))
+			for chunk in chunks:
+				lat, lon, ele = chunk[:3]
+				f.write(trkpts(lat, lon, ele, precision, chunk[3] if len(chunk) > 3 else None))
+				n = n + len(lat)
+				if progress is not None:
+					progress(n)
+			f.write(FOOTER)
+		os.replace(part, path)
+	except BaseException:
+		try:
+			os.remove(part)
+		except OSError:
+			pass
+		raise
+	return n
+
+def write(path, lat, lon, ele=None, name='GPX Track', tolerance=0, precision=None, progress=None):
+	""" Writes a track, first simplified to tolerance metres if that's > 0.
+	progress(fraction) is called after each WRITE_CHUNK points. """
+	lat = np.asarray(lat, dtype=float)
+	lon = np.asarray(lon, dtype=float)
+	if ele is not None:
+		ele = np.asarray(ele, dtype=float)
+	if tolerance and len(lat) > 2:
+		idx = simplify.douglas_peucker(lat, lon, tolerance)
+		lat = lat[idx]
+		lon = lon[idx]
+		if ele is not None:
+			ele = ele[idx]
+	total = max(len(lat), 1)
+
+	def chunks():
+		for i in range(0, len(lat), WRITE_CHUNK):
+			yield lat[i:i+WRITE_CHUNK], lon[i:i+WRITE_CHUNK], None if ele is None else ele[i:i+WRITE_CHUNK]
+
+	return write_chunks(path, chunks(), name, precision, None if progress is None else lambda n: progress(n / total))
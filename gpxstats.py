@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Summaries of every GPX file under a directory, without the map
+
+	python3 gpxstats.py ~/tracks > stats.csv
+	python3 gpxstats.py ~/tracks --format jsonl -o stats.jsonl --workers 8
+
+Files are read in a pool of processes, one per core by default, and a line
+written for each as soon as it is done, so the output is in the order files
+finish rather than by name. seconds is how long the file took to read and
+summarise.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import geometry
+import gpxio
+from track import Track
+
+# Metres a second below which a track point counts as stopped
+MOVING_SPEED = 0.5
+COLUMNS = ['file', 'points', 'length', 'lat_min', 'lat_max', 'lon_min', 'lon_max', 'ascent', 'descent', 'moving_time', 'seconds', 'error']
+
+def moving_time(lat, lon, times):
+	""" Seconds spent going faster than MOVING_SPEED. Gaps without times count as stopped. """
+	dt = np.diff(times)
+	d = geometry.segment_lengths(lat, lon)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		moving = (dt > 0) & (d / dt >= MOVING_SPEED)
+	return float(dt[moving].sum())
+
+def pieces(gpx):
+	""" (lat/lon/ele array, times or None) for each track segment, or for
+	each route if there are no tracks, or the waypoints if there are neither.
+	Nothing joins one piece to the next. """
+	if len(gpx.tracks):
+		return [(gpx.tracks[s], gpx.track_times[s]) for s in gpx.segments('tracks')]
+	if len(gpx.routes):
+		return [(gpx.routes[s], None) for s in gpx.segments('routes')]
+	if len(gpx.waypoints):
+		return [(gpx.waypoints, None)]
+	return []
+
+def stats(path):
+	""" The COLUMNS of one file, as a dict. Each figure is worked out over
+	every track segment separately, with the same Track code as the map, and
+	summed. """
+	start = time.perf_counter()
+	row = dict.fromkeys(COLUMNS, '')
+	row['file'] = path
+	try:
+		gpx = gpxio.read(path, times=True)
+		row['points'] = 0
+		length = ascent = descent = moving = 0.0
+		boxes = []
+		for pts, times in pieces(gpx):
+			track = Track.from_latlon(pts)
+			row['points'] = row['points'] + len(track)
+			length = length + track.length
+			up, down = track.climb()
+			ascent = ascent + up
+			descent = descent + down
+			boxes.append(track.bbox())
+			if times is not None:
+				moving = moving + moving_time(track.lat, track.lon, times)
+		if boxes:
+			boxes = np.array(boxes)
+			row['lat_min'], row['lon_min'] = float(boxes[:,0].min()), float(boxes[:,2].min())
+			row['lat_max'], row['lon_max'] = float(boxes[:,1].max()), float(boxes[:,3].max())
+			row['length'] = round(length, 1)
+			row['ascent'] = round(ascent, 1)
+			row['descent'] = round(descent, 1)
+			row['moving_time'] = round(moving, 1) if len(gpx.tracks) else ''
+	except Exception as e:
+		row['error'] = str(e) or type(e).__name__
+	row['seconds'] = round(time.perf_counter() - start, 4)
+	return row
+
+def gpx_files(directory):
+	""" Paths of .gpx files under directory, largest first so big ones don't
+	hold up the end of a run """
+	paths = []
+	for root, dirs, files in os.walk(directory):
+		for name in files:
+			if name.lower().endswith('.gpx'):
+				paths.append(os.path.join(root, name))
+	return sorted(paths, key=lambda p: -os.path.getsize(p))
+
+def summarise(paths, workers=None, window=None):
+	""" Yields stats() of each path as it finishes, with at most window files
+	queued across workers processes """
+	workers = workers or os.cpu_count() or 1
+	window = window or 4 * workers
+	paths = iter(paths)
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		pending = set()
+		try:
+			for path in paths:
+				pending.add(pool.submit(stats, path))
+				if len(pending) >= window:
+					done, pending = wait(pending, return_when=FIRST_COMPLETED)
+					for future in done:
+						yield future.result()
+			while pending:
+				done, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					yield future.result()
+		finally:
+			for future in pending:
+				future.cancel()
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Length, box, climb and moving time of every GPX file under a directory')
+	parser.add_argument('directory')
+	parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+	parser.add_argument('-o', '--output', help='default standard output')
+	parser.add_argument('--workers', type=int, help='default one per core')
+	args = parser.parse_args(argv)
+
+	paths = gpx_files(args.directory)
+	outfile = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+	start = time.perf_counter()
+	n = 0
+	busy = 0.0
+	try:
+		if args.format == 'csv':
+			writer = csv.DictWriter(outfile, COLUMNS)
+			writer.writeheader()
+			write = writer.writerow
+		else:
+			write = lambda row: outfile.write(json.dumps(row) + '\n')
+		for row in summarise(paths, args.workers):
+			write(row)
+			outfile.flush()
+			n = n + 1
+			busy = busy + row['seconds']
+	finally:
+		if outfile is not sys.stdout:
+			outfile.close()
+	elapsed = time.perf_counter() - start
+	print('%d files in %.1f s, %.1f s of work on %d workers' % (n, elapsed, busy, args.workers or os.cpu_count() or 1), file=sys.stderr)
+
+if __name__ == '__main__':
+	main()
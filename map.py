@@ -16,21 +16,46 @@
 # Web: https://donatherton.co.uk
 # WeatherWidget (c) Don Atherton don@donatherton.co.uk
 
+import time
+START = time.perf_counter()
+import os
+import sys
 import gi
 gi.require_version("Gtk", "3.0")
 gi.require_version('OsmGpsMap', '1.0')
 from gi.repository import Gtk,Gdk,GdkPixbuf,Gio,GObject,OsmGpsMap,GLib
-import gpsd
-import time
-import gpxpy
-import gpxpy.gpx
 import json
-import requests
-from urllib.parse import quote
-import math
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from os import path as Path
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_gtk3agg import FigureCanvasGTK3Agg as FigureCanvas
+import numpy as np
+import geometry
+from network import Network, TIMEOUT
+from track import Track, RunningLength
+from simplify import Pyramid
+from tracklayer import TrackLayer
+from spatial import GridIndex, TrackIndex, nearest_on_track
+import gpxio
+import tiles
+from tilestore import TileCache, TileServer
+from dem import DEM
+from gps import GpsClient, fix_time
+from recorder import Journal, Trail, journal_path, journal_to_gpx
+from cache import Cache, MemoryCache, cache_dir, search_key, reverse_key, route_key
+from geocode import search_url, reverse_url, cache_path
+# matplotlib and requests are imported where first used, and warmed up
+# once the window is showing
+
+# Set DONMAPS_TIMING to print startup times
+TIMING = bool(os.environ.get('DONMAPS_TIMING'))
+
+def timing(what):
+	""" Prints ms since start when TIMING is on """
+	if TIMING:
+		print('%s: %.0f ms' % (what, (time.perf_counter() - START) * 1000), file=sys.stderr)
+
+timing('imports')
 
 # CSS
 screen = Gdk.Screen.get_default()
@@ -42,6 +67,35 @@ css = b"""popover  {
 provider.load_from_data(css)
 Gtk.StyleContext.add_provider_for_screen(screen, provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
 
+ORS_URL = os.environ.get('DONMAPS_ORS') or 'https://api.openrouteservice.org'
+ORS_HEADERS = {
+    'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
+    'Authorization': '5b3ce3597851110001cf624831f2d1f9129542dfbd9a148cd579f14b',
+    'Content-Type': 'application/json; charset=utf-8'
+}
+# Fetch the other preference and neighbouring profiles when a route gets a
+# new start or end. Off by default as it costs up to three more requests on
+# the ORS key each time.
+ORS_PREFETCH = False
+# Dragging route points re-routes once they have been still this long (ms)
+ORS_DEBOUNCE = 400
+# Tracks with more points than this are saved in the background
+GPX_BACKGROUND = 20000
+# Route map caching takes the tiles within this many metres of the route,
+# with this many downloads at a time
+CORRIDOR_BUFFER = 250
+TILE_WORKERS = 2
+# Keep map tiles in one MBTiles file per map source under the cache folder,
+# dropping the least recently shown beyond TILE_BUDGET bytes
+TILE_STORE = True
+TILE_BUDGET = 1024 * 1024 * 1024
+# GPS recordings are journalled here as they go
+RECORD_DIR = os.environ.get('DONMAPS_TRACKS') or Path.join(Path.expanduser('~'), '.local', 'share', 'donmaps', 'tracks')
+# Elevation chart width in pixels
+PROFILE_WIDTH = 700
+# SRTM .hgt files for elevations without ORS
+DEM_DIR = os.environ.get('DONMAPS_DEM') or Path.join(Path.expanduser('~'), '.local', 'share', 'donmaps', 'dem')
+
 class UI(Gtk.Window):
 	def __init__(self):
 		""" Create map and sidebar objects  """
@@ -55,8 +109,25 @@ class UI(Gtk.Window):
 		self.vbox = Gtk.HBox()
 		self.add(self.vbox)
 
-		self.osm = OsmGpsMap.Map(max_zoom = 20)
-		self.osm.props.map_source = 1
+		self.tilecache = None
+		self.tileserver = None
+		self.tile_source = None
+		# Old osm-gps-map caches are moved into the store one at a time
+		self.tile_import = ThreadPoolExecutor(max_workers=1)
+		self.importing = set()
+		if TILE_STORE:
+			try:
+				self.tilecache = TileCache(os.path.join(cache_dir(), 'tiles'), TILE_BUDGET)
+				self.tileserver = TileServer(self.tilecache)
+				self.tileserver.start()
+			except Exception:
+				self.tilecache = self.tileserver = None
+		if self.tileserver is not None:
+			# The store is the only disk cache, osm-gps-map just keeps tiles in memory
+			self.osm = OsmGpsMap.Map(max_zoom = 20, tile_cache = 'none://')
+		else:
+			self.osm = OsmGpsMap.Map(max_zoom = 20)
+		self.set_map_source(1)
 
 		self.osm.set_center_and_zoom(50.15645980834961, -5.065123558044434, 12)
 		self.osm.layer_add(
@@ -148,6 +219,9 @@ class UI(Gtk.Window):
 		self.clear_button.set_label('Clear')
 		self.clear_button.connect('clicked',self.clear)
 
+		self.spinner = Gtk.Spinner()
+		self.spinner.set_no_show_all(True)
+
 		self.infowindow = Gtk.VBox()
 		self.infoLabel = Gtk.Label(margin=5)
 		self.infoLabel.set_line_wrap(True)
@@ -174,120 +248,139 @@ class UI(Gtk.Window):
 		hbox.pack_start(self.infowindow,False,False,0)
 		hbox.pack_end(cache_button, False, False, 0)
 		hbox.pack_end(self.len_label,False,False,10)
+		hbox.pack_end(self.spinner,False,False,0)
 
 		self.vbox.pack_start(hbox, False, False, 0)
 
 		self.via_route = []
 		self.viaImage = []
-
-	def distance_between(self, latlng1, latlng2):
-		""" Calculates distance between two points """
-		rad = 3.14159265358979323846264338327950288 / 180
-		lat1 = latlng1[0] * rad
-		lat2 = latlng2[0] * rad
-		sinDLat = math.sin((latlng2[0] - latlng1[0]) * rad / 2)
-		sinDLon = math.sin((latlng2[1] - latlng1[1]) * rad / 2)
-		a = sinDLat * sinDLat + math.cos(lat1) * math.cos(lat2) * sinDLon * sinDLon
-		c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-		return 6378137 * c
+		self.profile = None
+		self.gpx_layers = []
+
+		self.net = Network(on_busy=self.network_busy)
+		self.ors_request = None
+		self.ors_timer = None
+		self.ors_generation = 0
+		self.search_request = None
+		self.whats_here_request = None
+		self.geocache = Cache(cache_path())
+		self.routecache = MemoryCache(Cache(os.path.join(cache_dir(), 'routes.sqlite'), ttl=7 * 86400))
+		self.prefetching = set()
+		self.prefetched_ends = None
+		self.tile_download = None
+		self.gps = None
+		self.first_frame_handler = self.connect_after('draw', self.first_frame)
+		self.dem = None
+		if Path.isdir(DEM_DIR):
+			self.dem = DEM(DEM_DIR)
+
+	def quit(self, window):
+		if self.gps is not None:
+			self.gps.stop()
+		if hasattr(self, 'journal'):
+			self.journal.close()
+		if self.tile_download is not None:
+			self.tile_download.stop()
+		self.net.shutdown()
+		self.tile_import.shutdown(wait=False, cancel_futures=True)
+		if self.tileserver is not None:
+			self.tileserver.shutdown()
+			self.tilecache.close()
+		self.geocache.close()
+		self.routecache.close()
+		Gtk.main_quit()
+
+	def first_frame(self, widget, cr):
+		""" Only reports, once """
+		widget.disconnect(self.first_frame_handler)
+		timing('first frame')
+		GLib.idle_add(self.warm_up)
+		return False
+
+	def warm_up(self):
+		""" Loads what the first chart, GPX or search will need while nothing
+		else is happening, so the first click doesn't wait for it """
+		def modules():
+			import requests
+			import matplotlib.figure
+			import matplotlib.patches
+			import matplotlib.backends.backend_agg
+			timing('warm up')
+		threading.Thread(target=modules, daemon=True).start()
+		return False
+
+	def network_busy(self, pending):
+		""" Spinner shows while any request is in flight """
+		if pending > 0:
+			self.spinner.show()
+			self.spinner.start()
+		else:
+			self.spinner.stop()
+			self.spinner.hide()
 
 	def elevation(self, elev_button):
 		""" Uses matplotlib to create elevation diagram """
-		def ors_elev_call(wpts):
-			body = {"format_in":"polyline","format_out":"polyline","geometry":wpts}
-			headers = {
-	    'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
-	    'Authorization': '5b3ce3597851110001cf624831f2d1f9129542dfbd9a148cd579f14b',
-	    'Content-Type': 'application/json; charset=utf-8'
-			}
-			call = requests.post('https://api.openrouteservice.org/elevation/line', json=body, headers=headers,timeout=10)
+		def ors_elev_result(call):
 			if call.status_code == 200:
 				data = json.loads(call.text)
-				self.coords = data['geometry']
-
-		x = []
-		y = []
-		d = 0
+				self.points = Track.from_lonlat(data['geometry'])
+			self.elevation_chart()
 
-		if self.plot_button.get_active() or self.coords[0][2] == 'None':
-			tr = self.route.get_points()
-			wpts = []
-			for pt in tr:
-				wpts.append([pt.get_degrees()[1],pt.get_degrees()[0]])
+		if self.plot_button.get_active() or not self.points.has_elevation():
+			if self.plot_button.get_active():
+				tr = self.route.get_points()
+				# Nothing to chart until there are at least two points
+				if len(tr) < 2:
+					return
+				wpts = []
+				for pt in tr:
+					wpts.append([pt.get_degrees()[1],pt.get_degrees()[0]])
+				track = Track.from_lonlat(wpts)
+			else:
+				track = self.points
+				wpts = np.column_stack((self.points.lon, self.points.lat)).tolist()
+
+			# Local DEM files if they cover the whole route, otherwise ORS
+			if self.dem is not None:
+				ele = self.dem.sample(track.lat, track.lon)
+				if not np.isnan(ele).any():
+					self.points = track.with_elevation(ele)
+					self.elevation_chart()
+					return
 
-			ors_elev_call(wpts)
+			body = {"format_in":"polyline","format_out":"polyline","geometry":wpts}
+			self.net.post(ORS_URL + '/elevation/line', ors_elev_result, json=body, headers=ORS_HEADERS)
+		else:
+			self.elevation_chart()
 
+	def elevation_chart(self):
+		""" Shows the profile of self.points in the one chart, made on first use """
+		if len(self.points) < 2 or not self.points.has_elevation():
+			return False
+		if self.profile is None:
+			from profilechart import ElevationProfile
+			self.profile = ElevationProfile(PROFILE_WIDTH, 150, self.show_position, self.remove_posimage)
+			self.profile.set_relative_to(self.len_label)
+		self.profile.show_track(self.points)
+
+	def clear_profile(self):
+		""" The chart's track is out of date once the route changes """
+		if self.profile is not None:
+			self.profile.clear()
+
+	def show_position(self,lat,lon):
+		""" Crosshairs on the route where the mouse is over the chart """
 		try:
-			for i in range(len(self.coords)):
-				pt = (float(self.coords[i][1]), float(self.coords[i][0]))
-				elev = float(self.coords[i][2])
-				if i == 0:
-					x.append(0)
-					y.append(elev)
-				else:
-					latlng1 = (float(self.coords[i-1][1]), float(self.coords[i-1][0]))
-					d = d + self.distance_between(latlng1,pt)
-					x.append(d)
-					y.append(elev)
+			self.osm.image_remove(self.posImage)
 		except:
-			return False
-
-		f, a = plt.subplots(dpi=50)
-		f.set_facecolor('#aaaaaa')
-		a.set_facecolor('#aaaaaa')
-		a.plot(x,y,color='#174A75',alpha=.7,lw=0)
-		plt.gca().set_ylim(bottom=0)
-		a.fill_between(x,y,0)
-		plt.xlim([0,d])
-		plt.ylim(bottom=0)
-
-		vertical_line = a.axvline(color='#000000', lw=0.8)
-		canvas = FigureCanvas(f)
-		text = a.text(.98, .65, '', transform=a.transAxes,fontsize=18, fontweight='bold', horizontalalignment='right')
-
-		elev_popover = Gtk.Popover(margin=10)
-		elev_popover.set_size_request(700,150)
-		elev_box = Gtk.HBox()
-		elev_popover.add(elev_box)
-		elev_box.pack_start(canvas,True,True,0)
-
-		elev_popover.set_position(Gtk.PositionType.RIGHT)
-		elev_popover.set_relative_to(self.len_label)
-		elev_popover.show_all()
-
-		f.canvas.mpl_connect('figure_leave_event', self.remove_posimage)
-		f.canvas.mpl_connect('motion_notify_event', lambda event: self.onmouseover(event,a,text,vertical_line))
-
-	def onmouseover(self,event,a,text,vertical_line):
-		""" Puts info on diagram and route when diagram mouseover """
-		if event.xdata is not None:
-			try:
-				self.osm.image_remove(self.posImage)
-			except:
-				pass
-			d1 = 0
-			for i in range(len(self.coords)):
-				latlng1 = (float(self.coords[i][1]), float(self.coords[i][0]))
-				try:
-					latlng2 = (float(self.coords[i+1][1]), float(self.coords[i+1][0]))
-				except:
-					pass
-				d1 = d1 + self.distance_between(latlng2,latlng1)
-				if event.xdata < d1:
-					break
+			pass
+		try:
+			img = self.crosshairs
+		except AttributeError:
+			img = self.crosshairs = GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/crosshairs.svg', 25,25)
+		self.posImage = self.osm.image_add(lat,lon,img)
 
-			if event.xdata >= 1609:
-				txt = str(round(event.xdata/1609.34,2)) + ' miles'
-			else:
-				txt = str(round(event.xdata)) + 'm'
-			pos = [float(self.coords[i][1]),float(self.coords[i][0])]
-			img= GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/crosshairs.svg', 25,25)
-			self.posImage = self.osm.image_add(pos[0],pos[1],img)
-			text.set_text(str(self.coords[i][2]) + 'm\n' + txt)
-			vertical_line.set_xdata(event.xdata)
-			a.figure.canvas.draw()
-
-	def remove_posimage(self,widget):
+	def remove_posimage(self,*args):
 		""" posimage is crosshairs on route when diagam mouseover """
 		try:
 			self.osm.image_remove(self.posImage)
@@ -311,26 +404,46 @@ class UI(Gtk.Window):
 		if (event.type == Gdk.EventType.BUTTON_RELEASE and event.button == 1 or (event.button == 1 and event.get_state() & Gdk.ModifierType.CONTROL_MASK)) and not self.i:
 			pt = self.osm.get_event_location(event)
 			self.route.add_point(pt)
-			self.calc_track_length(self.route)
+			self.route_index.append(*pt.get_degrees())
+			self.route_length.append(*pt.get_degrees())
+			self.calc_track_length(self.route_length)
 		self.i = False
 
+	def plot_changed(self,track,i):
+		""" Keeps route_index and route_length in step with a dragged point """
+		lat, lon = track.get_point(i).get_degrees()
+		self.route_index.move(i,lat,lon)
+		self.route_length.move(i,lat,lon)
+		self.calc_track_length(self.route_length)
+
+	def plot_inserted(self,track,i):
+		lat, lon = track.get_point(i).get_degrees()
+		self.route_index.insert(i,lat,lon)
+		self.route_length.insert(i,lat,lon)
+		self.calc_track_length(self.route_length)
+
 	def plotButton(self,event):
 		self.i = False
 		if self.plot_button.get_active():
 			self.get_window().set_cursor(Gdk.Cursor(Gdk.CursorType.CROSS))
 			self.plot_button.set_label('Plotting...')
 			self.route = OsmGpsMap.MapTrack(editable = True,color = Gdk.RGBA(0,0,255,1),alpha = .8,line_width=2)
-			self.handler1 = self.route.connect('point-changed', self.calc_track_length)
+			self.handler1 = self.route.connect('point-changed', self.plot_changed)
 			self.osm.track_add(self.route)
 			self.handler = self.osm.connect_after('button-release-event',self.plot)
 			self.handler2 = self.osm.connect('changed', self.plot,0)
 			self.handler3 = self.route.connect('point-changed', self.plot)
 			self.handler4 = self.route.connect('point-inserted', self.plot)
+			self.route.connect('point-inserted', self.plot_inserted)
+			self.route_index = TrackIndex()
+			self.route_length = RunningLength()
 		elif not self.plot_button.get_active():
 			self.get_window().set_cursor(Gdk.Cursor(Gdk.CursorType.ARROW))
 			self.plot_button.set_label('Plot track')
 			self.osm.track_remove(self.route)
 			del(self.route)
+			del(self.route_length)
+			del(self.route_index)
 			self.len_label.set_text('')
 			self.osm.disconnect(self.handler)
 			self.osm.disconnect(self.handler1)
@@ -359,83 +472,51 @@ class UI(Gtk.Window):
 		dialog.add_filter(filter)
 		response = dialog.run()
 		if response == Gtk.ResponseType.OK:
-			gpx_file = open(dialog.get_filename(), 'r')
+			self.len_label.set_text('Loading...')
+			threading.Thread(target=self.read_gpx, args=(dialog.get_filename(),), daemon=True).start()
 
-			gpx = gpxpy.parse(gpx_file)
+		dialog.destroy()
+
+	def read_gpx(self,filename):
+		""" Runs in a thread so the window stays live while a big file loads """
+		def progress(fraction):
+			GLib.idle_add(self.len_label.set_text, 'Loading ' + str(round(fraction*100)) + '%')
+
+		try:
+			track = Track.from_latlon(gpxio.read(filename, progress).points())
+			pyramid = Pyramid(track.lat, track.lon)
+		except Exception:
+			track = pyramid = None
+		GLib.idle_add(self.show_gpx, track, pyramid)
+
+	def show_gpx(self,track,pyramid):
+		""" Puts a loaded GPX track on the map """
+		if track is not None and len(track) > 0:
+			self.points = track
+			self.clear_profile()
+			layer = TrackLayer(self.osm, track, pyramid, color = Gdk.RGBA(0,0,100,1),line_width=3, alpha=1)
+			self.gpx_layers.append(layer)
 
-			tr = []
-			self.coords = []
-			try:
-				for track in gpx.tracks:
-					for segment in track.segments:
-						for pt in segment.points:
-							lat = '{0}'.format(pt.latitude, pt.longitude, pt.elevation)
-							lon = '{1}'.format(pt.latitude, pt.longitude, pt.elevation)
-							elev = '{2}'.format(pt.latitude, pt.longitude, pt.elevation)
-							self.coords.append([lon,lat,elev])
-							pt = OsmGpsMap.MapPoint()
-							pt.set_degrees(float(lat),float(lon))
-							tr.append(pt)
-			except:
-				pass
 			try:
-				for waypoint in gpx.waypoints:
-					lat = '{0}'.format(waypoint.latitude, waypoint.longitude, waypoint.elevation)
-					lon = '{1}'.format(waypoint.latitude, waypoint.longitude, waypoint.elevation)
-					elev = '{2}'.format(waypoint.latitude, waypoint.longitude, waypoint.elevation)
-					self.coords.append([lon,lat,elev])
-					waypoint = OsmGpsMap.MapPoint()
-					waypoint.set_degrees(float(lat),float(lon))
-					tr.append(waypoint)
+				self.calc_track_length(layer)
 			except:
-				pass
+				self.len_label.set_text('No length')
+
+			beg = self.points[0]
+			end = self.points[-1]
+			self.osm.zoom_fit_bbox(*self.points.bbox())
+
 			try:
-				for trk in gpx.routes:
-					for pt in trk.points:
-						lat = '{0}'.format(pt.latitude, pt.longitude, pt.elevation)
-						lon = '{1}'.format(pt.latitude, pt.longitude, pt.elevation)
-						elev = '{2}'.format(pt.latitude, pt.longitude, pt.elevation)
-						self.coords.append([lon,lat,elev])
-						pt = OsmGpsMap.MapPoint()
-						pt.set_degrees(float(lat),float(lon))
-						tr.append(pt)
+				st= GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-start-icon-2x.png', 50,50)
+				self.startImage = self.osm.image_add(beg[0],beg[1],st)
+				nd= GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-end-icon-2x.png', 50,50)
+				self.endImage = self.osm.image_add(end[0],end[1],nd)
 			except:
 				pass
 
-			if len(tr) > 0:
-				self.route = OsmGpsMap.MapTrack(color = Gdk.RGBA(0,0,100,1),line_width=3, alpha=1)
-
-				for pt in tr:
-					self.route.add_point(pt)
-
-				self.osm.track_add(self.route)
-
-				try:
-					self.calc_track_length(self.route)
-				except:
-					self.len_label.set_text('No length')
-
-				beg = tr[0].get_degrees()
-				end = tr[-1].get_degrees()
-				self.osm.zoom_fit_bbox(
-							beg[0],
-							end[0],
-							beg[1],
-							end[1]
-							)
-
-				try:
-					st= GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-start-icon-2x.png', 50,50)
-					self.startImage = self.osm.image_add(beg[0],beg[1],st)
-					nd= GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-end-icon-2x.png', 50,50)
-					self.endImage = self.osm.image_add(end[0],end[1],nd)
-				except:
-					pass
-
-			else:
-				self.len_label.set_text('Can\'t read GPX')
-
-		dialog.destroy()
+		else:
+			self.len_label.set_text('Can\'t read GPX')
+		return False
 
 	def change_map_type(self,map_type):
 		sel = map_type.get_active_iter()
@@ -445,44 +526,160 @@ class UI(Gtk.Window):
 		else:
 			mapType= 'OSM'
 		if mapType == 'OSM':
-			self.osm.props.map_source = 1
+			self.set_map_source(1)
 		elif mapType == 'Satellite':
-			self.osm.props.map_source = 12
+			self.set_map_source(12)
 		elif mapType == 'Google':
-			self.osm.props.map_source = 9
+			self.set_map_source(9)
 		elif mapType == 'Topo':
-			self.osm.props.map_source = 5
+			self.set_map_source(5)
 
 	def get_location(self, button):
-		""" GPS """
-		self.track = OsmGpsMap.MapTrack(color = Gdk.RGBA(.4,.1,.7,1),line_width=7, alpha=1)
-		self.osm.track_add(self.track)
+		""" GPS on or off. Fixes come from gpsd as they arrive. """
+		if not button.get_active():
+			if self.gps is not None:
+				self.gps.stop()
+				self.gps = None
+			if hasattr(self, 'journal'):
+				self.journal.flush()
+			return
+		if self.gps is None:
+			self.gps = GpsClient(self.gps_fix)
+			self.gps.start()
+
+	def gps_fix(self, tpv):
+		""" Follows and records a TPV report from gpsd """
+		lat = tpv['lat']
+		lon = tpv['lon']
+		if not hasattr(self, 'track'):
+			self.track = TrackLayer(self.osm, color = Gdk.RGBA(.4,.1,.7,1),line_width=7, alpha=1)
+			self.trail = Trail()
+			self.journal = Journal(journal_path(RECORD_DIR))
+		self.osm.set_center(lat,lon)
+		self.infoLabel.set_text(str(lat) + '\n' + str(lon))
+		# Every fix goes to the journal, the map only gets a bounded trail
+		self.journal.append(fix_time(tpv), lat, lon, tpv.get('alt'))
+		if self.trail.append(lat,lon):
+			self.track.replace(*self.trail.points())
+		else:
+			self.track.append(lat,lon)
 
-		def gpsPoll():
-			if button.get_active():
+	def set_map_source(self, source):
+		""" Switches map, through the tile store if there is one """
+		if self.tile_source is not None and self.tile_source[0] == source:
+			return
+		self.osm.props.map_source = source
+		if self.tileserver is None:
+			return
+		# repo_uri is now the source's real one, until it's swapped for the store's
+		uri = self.osm.props.repo_uri
+		fmt = self.osm.props.image_format
+		max_zoom = self.osm.props.max_zoom
+		self.tile_source = (source, uri, fmt, max_zoom)
+		self.osm.props.repo_uri = self.tileserver.add(source, uri, fmt, max_zoom)
+		self.osm.map_redraw()
+		# Move in whatever osm-gps-map cached itself before the store was used
+		old = os.path.join(OsmGpsMap.Map.get_default_cache_directory(), hashlib.md5(uri.encode()).hexdigest())
+		if Path.isdir(old) and old not in self.importing:
+			self.importing.add(old)
+			store = self.tilecache.store(source, fmt)
+
+			def pack():
 				try:
-					gpsd.connect()
-					loc = gpsd.get_current().position()
-					self.osm.set_center(loc[0],loc[1])
-					self.infoLabel.set_text(str(loc[0]) + '\n' + str(loc[1]))
-					pt = OsmGpsMap.MapPoint()
-					pt.set_degrees(loc[0],loc[1])
-					self.track.add_point(pt)
-				except:
-					pass
+					store.pack(old, fmt)
+				finally:
+					self.importing.discard(old)
 
-			return True
+			self.tile_import.submit(pack)
 
-		self.timeout_add = GLib.timeout_add(1000, gpsPoll)
+	def tile_target(self):
+		""" Where saved tiles go, the real URI to get them from, and max zoom """
+		if self.tileserver is None:
+			fmt = self.osm.props.image_format
+			return tiles.TileDir(self.osm.props.tile_cache, fmt), self.osm.props.repo_uri, self.osm.props.max_zoom
+		source, uri, fmt, max_zoom = self.tile_source
+		return self.tilecache.store(source, fmt), uri, max_zoom
 
 	def cache_clicked(self, button):
-		""" Saves maps in cache """
-		bbox = self.osm.get_bbox()
-		self.osm.download_maps(
-			*bbox,
-			zoom_start=self.osm.props.zoom,
-			zoom_end=self.osm.props.max_zoom
+		""" Saves maps in cache, just along the route if there is one """
+		if self.tile_download is not None:
+			# Stops it. Clicking again later picks up where it left off.
+			self.tile_download.stop()
+			return
+		zoom = self.osm.props.zoom
+		columns = self.route_columns()
+		if columns is None or len(columns[0]) == 0:
+			pt1, pt2 = self.osm.get_bbox()
+			if self.tileserver is None:
+				self.osm.download_maps(
+					pt1, pt2,
+					zoom_start=zoom,
+					zoom_end=self.osm.props.max_zoom
+				)
+				return
+			# osm-gps-map's own download doesn't go through the store
+			self.view_tiles(pt1.get_degrees() + pt2.get_degrees(), zoom, self.tile_target())
+			return
+		self.len_label.set_text('Counting tiles...')
+		threading.Thread(target=self.corridor_tiles, args=(columns[0], columns[1], zoom, self.tile_target()), daemon=True).start()
+
+	def corridor_tiles(self, lat, lon, zoom, target):
+		""" Works out in a thread which tiles near the route aren't saved yet """
+		store, uri, max_zoom = target
+		needed = []
+		for z in range(zoom, max_zoom + 1):
+			corridor = tiles.corridor(lat, lon, z, CORRIDOR_BUFFER)
+			needed.extend((z, x, y) for x, y in tiles.missing(store, corridor, z))
+		text = 'within %d m of the route' % CORRIDOR_BUFFER
+		GLib.idle_add(self.confirm_tiles, needed, len(needed), text, zoom, target)
+
+	def view_tiles(self, bbox, zoom, target):
+		""" Every tile in view from zoom down. Too many to list, so they are
+		generated as they go and ones already saved are skipped then. """
+		store, uri, max_zoom = target
+		ranges = [tiles.area(*bbox, z) for z in range(zoom, max_zoom + 1)]
+		needed = ((z, x, y) for z, (xs, ys) in zip(range(zoom, max_zoom + 1), ranges) for x in xs for y in ys)
+		total = sum(len(xs) * len(ys) for xs, ys in ranges)
+		self.confirm_tiles(needed, total, 'in view, some of which may be saved already,', zoom, target)
+
+	def confirm_tiles(self, needed, total, text, zoom, target):
+		""" Says how much there is to fetch before starting """
+		self.len_label.set_text('')
+		if total == 0:
+			self.infoLabel.set_text('Maps already saved')
+			return False
+		store, uri, max_zoom = target
+		dialog = Gtk.MessageDialog(
+			transient_for=self, flags=0, message_type=Gtk.MessageType.QUESTION,
+			buttons=Gtk.ButtonsType.OK_CANCEL, text='Save maps?'
+		)
+		dialog.format_secondary_text(
+			'%d tiles, about %.0f MB, %s at zoom %d to %d'
+			% (total, total * store.average_size() / 1e6, text, zoom, max_zoom)
 		)
+		response = dialog.run()
+		dialog.destroy()
+		if response != Gtk.ResponseType.OK:
+			return False
+
+		def progress(done, total, failed):
+			GLib.idle_add(self.len_label.set_text, 'Maps ' + str(round((done + failed) * 100 / total)) + '%')
+
+		def finished(done, failed):
+			GLib.idle_add(self.tiles_saved, done, failed, total)
+
+		self.tile_download = tiles.Downloader(store, uri, max_zoom, needed, total, TILE_WORKERS, progress, finished)
+		self.tile_download.start()
+		return False
+
+	def tiles_saved(self, done, failed, total):
+		self.tile_download = None
+		self.len_label.set_text('')
+		if done < total:
+			self.infoLabel.set_text('Saved ' + str(done) + ' of ' + str(total) + ' map tiles. Click Cache to carry on.')
+		else:
+			self.infoLabel.set_text('Maps saved')
+		return False
 
 	def delete(self,delete_button,event,i):
 		""" Delete via waypoints in ors route """
@@ -494,9 +691,10 @@ class UI(Gtk.Window):
 	def delete_plot(self,delete_button,event,i):
 		""" Delete waypoints in plot route """
 		self.route.remove_point(i)
-		self.osm.track_remove(self.route)
-		self.osm.track_add(self.route)
-		self.calc_track_length(self.route)
+		self.route_index.remove(i)
+		self.route_length.remove(i)
+		self.osm.map_redraw()
+		self.calc_track_length(self.route_length)
 
 	def on_mouse_click(self, osm, event):
 		""" Deals with various mouse clicks on map """
@@ -532,29 +730,20 @@ class UI(Gtk.Window):
 			# Delete point in ors route
 			j = False
 			try:
-				for i in range(len(self.via_route)):
-					if self.distance_between(self.pt_clicked,self.via_route[i]) < 30:
-#						print(i)
-						delete_button = Gtk.MenuItem()
-						popover.append(delete_button)
-						delete_button.set_label('Delete point')
-						delete_button.connect('button_press_event',self.delete,i)
-						j = True
+				via = np.array(self.via_route, dtype=float).reshape(-1, 2)
+				near = geometry.haversine(via[:,0], via[:,1], self.pt_clicked[0], self.pt_clicked[1]) < 30
+				for i in np.flatnonzero(near).tolist():
+					delete_button = Gtk.MenuItem()
+					popover.append(delete_button)
+					delete_button.set_label('Delete point')
+					delete_button.connect('button_press_event',self.delete,i)
+					j = True
 			except:
 				pass
 			try: # Delete point in plot track
-				i=0
-				pts = self.route.get_points()
-				x = float('inf')
-				for pt in pts:
-					d = self.distance_between(self.pt_clicked,pt.get_degrees())
-					# Find the nearest, not all within 30m
-					if d < 30:
-						if d < x:
-							x = d
-							y = i
-					i = i + 1
-				if x < float('inf'):
+				# Find the nearest, not all within 30m
+				y, x = self.route_index.nearest(self.pt_clicked[0], self.pt_clicked[1], 30)
+				if y is not None:
 					delete_button = Gtk.MenuItem()
 					popover.append(delete_button)
 					delete_button.set_label('Delete point')
@@ -604,11 +793,38 @@ class UI(Gtk.Window):
 		elif event.type == Gdk.EventType.BUTTON_PRESS and event.button == 1:
 			self.get_window().set_cursor(Gdk.Cursor(Gdk.CursorType.FLEUR))
 
+	def cached_get(self,url,key,callback):
+		""" Calls back with the response body from the Nominatim cache, or fetches and caches it.
+		Expired entries are still used if the network fails. """
+		content = self.geocache.get(key)
+		if content is not None:
+			callback(content)
+			return None
+
+		def result(response):
+			if response.status_code == 200:
+				self.geocache.put(key, response.content)
+				callback(response.content)
+
+		def offline(e):
+			content = self.geocache.get(key, stale=True)
+			if content is not None:
+				callback(content)
+
+		return self.net.get(url, result, offline)
+
 	def whats_here(self,wh,x,lat,lon):
 		""" Polls nominatim for what's nearby """
-		searchUrl = 'https://nominatim.openstreetmap.org/?addressdetails=1&q=' + str(lat) + ',' + str(lon) + '&format=json&limit=1'
-		location = requests.get(searchUrl,timeout=10)
-		location = json.loads(location.text)
+		searchUrl = reverse_url(lat,lon)
+		if self.whats_here_request is not None:
+			self.whats_here_request.cancel()
+		# A cache hit calls back straight away and may already have started the icon request
+		req = self.cached_get(searchUrl, reverse_key(lat,lon), self.whats_here_result)
+		if req is not None:
+			self.whats_here_request = req
+
+	def whats_here_result(self,location):
+		location = json.loads(location)
 
 		self.infoLabel.set_text(location[0]['display_name'])
 
@@ -619,19 +835,24 @@ class UI(Gtk.Window):
 		try:
 			self.icon = Gtk.Image()
 			self.infowindow.pack_start(self.icon,False,False,0)
-			response = requests.get(location[0]['icon'],timeout=10)
+			self.whats_here_request = self.cached_get(location[0]['icon'], 'icon:' + location[0]['icon'], lambda content: self.set_icon(content,location[0]['type']))
+		except:
+			pass
+
+		self.infomark = GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-icon-2.png', 60,60)
+		self.infomark = self.osm.image_add(float(location[0]['lat']),float(location[0]['lon']),self.infomark)
 
-			input_stream = Gio.MemoryInputStream.new_from_data(response.content, None)
+	def set_icon(self,content,tooltip):
+		""" Shows the icon of a What's here result """
+		try:
+			input_stream = Gio.MemoryInputStream.new_from_data(content, None)
 			pixbuf = GdkPixbuf.Pixbuf.new_from_stream_at_scale(input_stream, width=20, height=20, preserve_aspect_ratio=True, cancellable=None)
 			self.icon.set_from_pixbuf(pixbuf)
-			self.icon.set_tooltip_text(location[0]['type'])
+			self.icon.set_tooltip_text(tooltip)
 			self.icon.show()
 		except:
 			pass
 
-		self.infomark = GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-icon-2.png', 60,60)
-		self.infomark = self.osm.image_add(float(location[0]['lat']),float(location[0]['lon']),self.infomark)
-
 	def pick(self,widget,row,col):
 		model = widget.get_model()
 		lat = model[row][1]
@@ -640,13 +861,16 @@ class UI(Gtk.Window):
 
 	def geoSearch(self,search):
 		""" Main location search """
-		box = Gtk.VBox()
 		geosearch = search.get_text()
 
-		searchUrl = 'https://nominatim.openstreetmap.org/?format=json&addressdetails=1&q=' + quote(geosearch) + '&format=json&limit=8'
+		searchUrl = search_url(geosearch)
 
-		location = requests.get(searchUrl,timeout=10)
-		location = json.loads(location.text)
+		if self.search_request is not None:
+			self.search_request.cancel()
+		self.search_request = self.cached_get(searchUrl, search_key(geosearch), lambda location: self.geoSearch_result(search,location))
+
+	def geoSearch_result(self,search,location):
+		location = json.loads(location)
 
 		store = Gtk.ListStore(str,float,float)
 
@@ -675,6 +899,27 @@ class UI(Gtk.Window):
 
 	def clear(self,clear_button):
 		""" Clears all routes """
+		for layer in self.gpx_layers:
+			layer.remove()
+		self.gpx_layers = []
+		try:
+			self.ors_layer.remove()
+			del(self.ors_layer)
+		except:
+			pass
+		try:
+			self.track.remove()
+			del(self.track)
+			del(self.trail)
+			self.journal.close()
+			del(self.journal)
+		except:
+			pass
+		# Right-clicks mustn't find points of a plot that has gone
+		try:
+			del(self.route_index)
+		except AttributeError:
+			pass
 		try:
 			self.osm.track_remove_all()
 			self.osm.image_remove_all()
@@ -682,7 +927,8 @@ class UI(Gtk.Window):
 			del(self.end_route)# = []
 			self.via_route = []
 			del(self.route)# = []
-			del(self.coords)# = []
+			del(self.points)# = []
+			self.clear_profile()
 			self.infoLabel.set_text('')
 			self.infowindow.remove(self.icon)
 		except:
@@ -690,12 +936,11 @@ class UI(Gtk.Window):
 
 	def edit(self,track,point):
 		""" Calculates between which waypoints new point should go. """
-		minDist = float('inf')
-		for i in range(len(self.coords)-1,  0,  -1):
-				d = self.distance_between(self.pt_clicked,[self.coords[i][1],self.coords[i][0]])
-				if d < minDist:
-					minIndex = i
-					minDist = d
+		# Nearest segment, from the index where it can be sure of the answer
+		longest = float(np.diff(self.points.dist).max()) if len(self.points) > 1 else 0.0
+		minIndex = nearest_on_track(self.points_index, self.points.lat, self.points.lon, self.pt_clicked, longest)[0]
+		if minIndex is None:
+			return
 
 		j = len(self.route_json['features'][0]['properties']['way_points'])-1
 		while j >= 0 and self.route_json['features'][0]['properties']['way_points'][j] > minIndex:
@@ -703,12 +948,8 @@ class UI(Gtk.Window):
 
 		self.ors_route(self, j,self.pt_released[0],self.pt_released[1])
 
-	def ors_call(self):
+	def ors_call(self,*args):
 		""" Gets route from Open Route Service """
-		try:
-			self.osm.track_remove(self.orsRoute)
-		except:
-			pass
 		try:
 			sel = self.ors_profile.get_active_iter()
 			if sel is not None:
@@ -728,61 +969,123 @@ class UI(Gtk.Window):
 				Route.append([self.via_route[i][1],self.via_route[i][0]])
 			Route.insert(0,[self.start_route[1],self.start_route[0]])
 			Route.append([self.end_route[1],self.end_route[0]])
-
-			body = {"coordinates":Route,"elevation":"true","preference":pref}
 		except:
 			return
 
-		headers = {
-    'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
-    'Authorization': '5b3ce3597851110001cf624831f2d1f9129542dfbd9a148cd579f14b',
-    'Content-Type': 'application/json; charset=utf-8'
-		}
-		call = requests.post('https://api.openrouteservice.org/v2/directions/' + orsProfile + '/geojson', json=body, headers=headers,timeout=10)
-
-		if call.status_code == 200:
-			self.route_json = json.loads(call.text)
-			del(Route)
-
-			self.coords = self.route_json['features'][0]['geometry']['coordinates']
-
-			self.orsRoute = OsmGpsMap.MapTrack(editable=True,alpha=1,line_width=2)
-			self.orsRoute.connect('point-changed',self.edit)
-
-			for i in range(len(self.coords)):
-				pt = OsmGpsMap.MapPoint()
-				pt.set_degrees(float(self.coords[i][1]), float(self.coords[i][0]))
-				self.orsRoute.add_point(pt)
-
-			self.osm.track_add(self.orsRoute)
-			self.calc_track_length(self.orsRoute)
-
-			bbox = self.route_json['features'][0]['bbox']
-			self.osm.zoom_fit_bbox(bbox[1],bbox[4],bbox[0],bbox[3])
-
-			self.instruction = ''
-			for i in range(len(self.route_json['features'][0]['properties']['segments'])):
-				for j in range(len(self.route_json['features'][0]['properties']['segments'][i]['steps'])):
-					step = self.route_json['features'][0]['properties']['segments'][i]['steps'][j]
-					stepDistance = step['distance']
-					if stepDistance > 1000:
-						stepDistance = str(round((stepDistance/1609.34)*100)/100) + ' miles'
-					else:
-						stepDistance = str(stepDistance) + 'm'
-					self.instruction = self.instruction + '- ' + step['instruction'] + ' (' + stepDistance + ')\n'
+		# Only the latest route is wanted
+		if self.ors_timer is not None:
+			GLib.source_remove(self.ors_timer)
+			self.ors_timer = None
+		if self.ors_request is not None:
+			self.ors_request.cancel()
+			self.ors_request = None
+		self.ors_generation = self.ors_generation + 1
+		generation = self.ors_generation
+
+		def draw(route):
+			# Anything superseded while in flight is thrown away
+			if generation == self.ors_generation:
+				self.ors_result(route)
+
+		# The reply is parsed and simplified on a worker, cached or not
+		content = self.routecache.get(route_key(orsProfile,pref,Route))
+		if content is not None:
+			self.ors_request = self.net.submit(lambda session: self.prepare_route(content), draw)
+		else:
+			self.ors_request = self.ors_fetch(orsProfile,pref,Route,draw,prepare=True)
+
+		# Not for via changes or drags, which keep the same ends
+		ends = (tuple(Route[0]),tuple(Route[-1]))
+		if ORS_PREFETCH and ends != self.prefetched_ends:
+			self.prefetched_ends = ends
+			self.ors_prefetch(orsProfile,pref,Route)
+
+	def ors_fetch(self,orsProfile,pref,Route,callback,error=None,prepare=False):
+		""" Requests a route from ORS and caches the reply. callback gets the
+		reply, or with prepare the prepare_route() of it. """
+		key = route_key(orsProfile,pref,Route)
+		body = {"coordinates":Route,"elevation":"true","preference":pref}
+
+		def fetch(session):
+			call = session.post(ORS_URL + '/v2/directions/' + orsProfile + '/geojson', json=body, headers=ORS_HEADERS, timeout=TIMEOUT)
+			if prepare and call.status_code == 200:
+				return call, self.prepare_route(call.content)
+			return call, None
+
+		def result(reply):
+			call, route = reply
+			if call.status_code == 200:
+				self.routecache.put(key, call.content)
+				callback(route if prepare else call.content)
+			elif error is not None:
+				error(call)
+
+		return self.net.submit(fetch, result, error)
+
+	def prepare_route(self,content):
+		""" Parses an ORS reply and builds its index and pyramid. Runs on a
+		network worker, as the pyramid is too slow for the main loop. """
+		route_json = json.loads(content)
+		points = Track.from_lonlat(route_json['features'][0]['geometry']['coordinates'])
+		return route_json, points, GridIndex.from_arrays(points.lat, points.lon), Pyramid(points.lat, points.lon)
+
+	def ors_prefetch(self,orsProfile,pref,Route):
+		""" Fetches the other preference and the neighbouring profiles into the cache """
+		model = self.ors_profile.get_model()
+		profiles = [row[0] for row in model]
+		other = 'fastest' if pref == 'shortest' else 'shortest'
+		wanted = [(orsProfile,other)]
+		i = profiles.index(orsProfile) if orsProfile in profiles else -1
+		for j in (i - 1, i + 1):
+			if i >= 0 and 0 <= j < len(profiles):
+				wanted.append((profiles[j],pref))
+
+		for p, q in wanted:
+			key = route_key(p,q,Route)
+			if key in self.prefetching or key in self.routecache:
+				continue
+			self.prefetching.add(key)
+			done = lambda *args, key=key: self.prefetching.discard(key)
+			self.ors_fetch(p,q,Route,done,done)
+
+	def ors_result(self,route):
+		""" Draws a prepare_route() route, replacing any previous one """
+		try:
+			self.ors_layer.remove()
+		except:
+			pass
+		self.route_json, self.points, self.points_index, pyramid = route
+		self.clear_profile()
+
+		self.ors_layer = TrackLayer(self.osm, self.points, pyramid, signals=[('point-changed',self.edit)], editable=True,alpha=1,line_width=2)
+		self.calc_track_length(self.ors_layer)
+
+		bbox = self.route_json['features'][0]['bbox']
+		self.osm.zoom_fit_bbox(bbox[1],bbox[4],bbox[0],bbox[3])
+
+		self.instruction = ''
+		for i in range(len(self.route_json['features'][0]['properties']['segments'])):
+			for j in range(len(self.route_json['features'][0]['properties']['segments'][i]['steps'])):
+				step = self.route_json['features'][0]['properties']['segments'][i]['steps'][j]
+				stepDistance = step['distance']
+				if stepDistance > 1000:
+					stepDistance = str(round((stepDistance/1609.34)*100)/100) + ' miles'
+				else:
+					stepDistance = str(stepDistance) + 'm'
+				self.instruction = self.instruction + '- ' + step['instruction'] + ' (' + stepDistance + ')\n'
 
 	def ors_route(self,widget,event,lat,lon):
 		if  isinstance(event,int): # Called by edit()
 			va= GdkPixbuf.Pixbuf.new_from_file_at_size (self.path + '/images/marker-via-icon-2x.png', 50,50)
 			index = event # Easier to read
 			try:
-				if self.distance_between(self.pt_clicked,self.via_route[index-1]) < 20:
+				if geometry.distance(self.pt_clicked,self.via_route[index-1]) < 20:
 					self.osm.image_remove(self.viaImage[index-1])
 					self.viaImage.pop(index-1)
 					self.via_route.pop(index-1)
 			except:
 				try:
-					if self.distance_between(self.pt_clicked,self.via_route[index]) < 20:
+					if geometry.distance(self.pt_clicked,self.via_route[index]) < 20:
 						self.osm.image_remove(self.viaImage[index])
 						self.viaImage.pop(index)
 						self.via_route.pop(index)
@@ -815,7 +1118,25 @@ class UI(Gtk.Window):
 
 				self.via_route.insert(0,[lat,lon])
 
+		if isinstance(event,int):
+			self.schedule_ors_call()
+		else:
+			self.ors_call()
+
+	def schedule_ors_call(self):
+		""" Coalesces route edits so only the last within ORS_DEBOUNCE ms is sent """
+		self.ors_generation = self.ors_generation + 1
+		if self.ors_request is not None:
+			self.ors_request.cancel()
+			self.ors_request = None
+		if self.ors_timer is not None:
+			GLib.source_remove(self.ors_timer)
+		self.ors_timer = GLib.timeout_add(ORS_DEBOUNCE, self.debounced_ors_call)
+
+	def debounced_ors_call(self):
+		self.ors_timer = None
 		self.ors_call()
+		return False
 
 	def dir(self,dir_button):
 		""" Directions for ORS route """
@@ -843,33 +1164,14 @@ class UI(Gtk.Window):
 
 	def gpx(self,button):
 		""" Saves GPX file """
-		header = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1"  creator="DonMaps" version="1.1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd">\n<trk>\n<name>GPX Track</name>\n<trkseg>\n'
-
-		gpxtrack = ''
-		try: # ORS route
-			for pt in self.coords:
-				try:
-					pt = pt.get_degrees()
-				except:
-					pass
-				if len(pt) == 3:
-					ele = '<ele>' + str(pt[2]) + '</ele>'
-				else:
-					ele = ''
-				gpxtrack = gpxtrack + '<trkpt lat="' + str(pt[1]) + '" lon="' + str(pt[0]) + '">' + ele + '</trkpt>\n'
-		except: # track plot
-			try:
-				tr = self.route.get_points()
-				for pt in tr:
-					gpxtrack = gpxtrack + '<trkpt lat="' + str(pt.get_degrees()[0]) + '" lon="' + str(pt.get_degrees()[1]) + '"></trkpt>\n'
-			except: # GPS plotted track
-				try:
-					tr = self.track.get_points()
-					for pt in tr:
-						gpxtrack = gpxtrack + '<trkpt lat="' + str(pt.get_degrees()[0]) + '" lon="' + str(pt.get_degrees()[1]) + '"></trkpt>\n'
-				except:
-					return
-		gpxtrack = header + gpxtrack + '</trkseg>\n</trk>\n</gpx>'
+		columns = self.route_columns()
+		if columns is None:
+			return
+		lat, lon, ele = columns
+		# A GPS recording is saved from its journal, which has every fix
+		journal = None
+		if not hasattr(self, 'points') and not hasattr(self, 'route_length') and hasattr(self, 'journal'):
+			journal = self.journal
 
 		dialog = Gtk.FileChooserDialog(
 		title="GPX file", parent=self, action=Gtk.FileChooserAction.SAVE
@@ -881,18 +1183,80 @@ class UI(Gtk.Window):
 			Gtk.ResponseType.OK,
 		)
 
+		# Optional shrinking of the file
+		options = Gtk.HBox(spacing=5)
+		options.pack_start(Gtk.Label(label='Simplify to (m, 0 = off)'),False,False,0)
+		tolerance = Gtk.SpinButton.new_with_range(0,100,1)
+		options.pack_start(tolerance,False,False,0)
+		options.pack_start(Gtk.Label(label='Decimal places (0 = all)'),False,False,10)
+		precision = Gtk.SpinButton.new_with_range(0,15,1)
+		options.pack_start(precision,False,False,0)
+		options.show_all()
+		tolerance.set_sensitive(journal is None)
+		dialog.set_extra_widget(options)
+
 		filename = dialog.set_current_name('GPX track.gpx')
 		response = dialog.run()
-		if response == Gtk.ResponseType.OK:
-			gpx_file = open(dialog.get_filename(), 'w')
-			gpx_file.write(gpxtrack)
-			gpx_file.close()
+		if response == Gtk.ResponseType.OK and journal is not None:
+			journal.flush()
+			threading.Thread(target=self.write_journal, args=(self.len_label.get_text(), journal.path, dialog.get_filename(), precision.get_value_as_int() or None), daemon=True).start()
+		elif response == Gtk.ResponseType.OK:
+			args = (dialog.get_filename(), lat, lon, ele)
+			kwargs = {'tolerance': tolerance.get_value(), 'precision': precision.get_value_as_int() or None}
+			if len(lat) > GPX_BACKGROUND:
+				# The label is read here as GTK is only safe on the main thread
+				threading.Thread(target=self.write_gpx, args=(self.len_label.get_text(),) + args, kwargs=kwargs, daemon=True).start()
+			else:
+				try:
+					gpxio.write(*args, **kwargs)
+				except Exception:
+					self.len_label.set_text('Couldn\'t save GPX')
 
 		dialog.destroy()
 
+	def write_journal(self,text,journal,filename,precision):
+		""" Saves a GPS recording in a thread, streaming it from disk, and puts
+		text back in len_label when done """
+		def progress(n):
+			GLib.idle_add(self.len_label.set_text, 'Saved ' + str(n) + ' points')
+
+		try:
+			journal_to_gpx(journal, filename, precision=precision, progress=progress)
+			GLib.idle_add(self.len_label.set_markup, '<b>' + GLib.markup_escape_text(text) + '</b>')
+		except Exception:
+			GLib.idle_add(self.len_label.set_text, 'Couldn\'t save GPX')
+
+	def route_columns(self):
+		""" lat, lon, ele of whatever route is up, or None """
+		try: # ORS route or loaded GPX
+			return self.points.columns()
+		except: # track plot
+			try:
+				pts = np.array(self.route_length.pts, dtype=float).reshape(-1, 2)
+				return pts[:,0], pts[:,1], None
+			except: # GPS plotted track
+				try:
+					lat, lon = self.track.points()
+					return lat, lon, None
+				except:
+					return None
+
+	def write_gpx(self,text,filename,lat,lon,ele,**kwargs):
+		""" Saves big tracks in a thread, showing progress in len_label and
+		putting text back in it when done """
+		def progress(fraction):
+			GLib.idle_add(self.len_label.set_text, 'Saving ' + str(round(fraction*100)) + '%')
+
+		try:
+			gpxio.write(filename, lat, lon, ele, progress=progress, **kwargs)
+			GLib.idle_add(self.len_label.set_markup, '<b>' + GLib.markup_escape_text(text) + '</b>')
+		except Exception:
+			GLib.idle_add(self.len_label.set_text, 'Couldn\'t save GPX')
+
 
 win = UI()
-win.connect("destroy", Gtk.main_quit)
+win.connect("destroy", win.quit)
 win.show_all()
+timing('window')
 Gtk.main()
 
@@ -0,0 +1,100 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" HTTP off the GTK main loop, over pooled keep-alive sessions """
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+USER_AGENT = 'DonMaps'
+TIMEOUT = 10
+
+def new_session():
+	""" requests.Session with our User-Agent. requests is only imported here,
+	on first use off the main thread, as it's slow to load. """
+	import requests
+	session = requests.Session()
+	session.headers['User-Agent'] = USER_AGENT
+	return session
+
+class Request:
+	""" Handle for a submitted request. cancel() stops the callback being run. """
+	def __init__(self):
+		self.future = None
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+		if self.future is not None:
+			self.future.cancel()
+
+class Network:
+	def __init__(self, workers=4, dispatch=None, on_busy=None):
+		""" dispatch runs a function on the main loop, GLib.idle_add by default.
+		on_busy(n) is called there whenever the number of pending requests changes. """
+		if dispatch is None:
+			from gi.repository import GLib
+			dispatch = GLib.idle_add
+		self.dispatch = dispatch
+		self.on_busy = on_busy
+		self.pending = 0
+		self.local = threading.local()
+		self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='network')
+
+	def session(self):
+		""" One keep-alive session per worker thread, as Session isn't thread safe """
+		try:
+			return self.local.session
+		except AttributeError:
+			session = self.local.session = new_session()
+			return session
+
+	def submit(self, fn, callback, error=None):
+		""" Runs fn(session) on a worker, then callback(result) on the main loop.
+		Exceptions go to error(exception) instead, if given. """
+		req = Request()
+		req.future = self.pool.submit(lambda: fn(self.session()))
+		self.busy(1)
+		req.future.add_done_callback(lambda future: self.dispatch(self.finish, req, callback, error))
+		return req
+
+	def finish(self, req, callback, error):
+		self.busy(-1)
+		if not req.cancelled:
+			try:
+				result = req.future.result()
+			except Exception as e:
+				if error is not None:
+					error(e)
+			else:
+				callback(result)
+		return False
+
+	def busy(self, n):
+		self.pending = self.pending + n
+		if self.on_busy is not None:
+			self.on_busy(self.pending)
+
+	def get(self, url, callback, error=None, **kwargs):
+		kwargs.setdefault('timeout', TIMEOUT)
+		return self.submit(lambda session: session.get(url, **kwargs), callback, error)
+
+	def post(self, url, callback, error=None, **kwargs):
+		kwargs.setdefault('timeout', TIMEOUT)
+		return self.submit(lambda session: session.post(url, **kwargs), callback, error)
+
+	def shutdown(self):
+		self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,130 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Elevation chart popover, made once and redrawn for each route """
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, GLib
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.patches import Polygon
+from matplotlib.backends.backend_gtk3agg import FigureCanvasGTK3Agg as FigureCanvas
+from simplify import lttb
+
+def distance_text(d):
+	if d >= 1609:
+		return str(round(d/1609.34,2)) + ' miles'
+	return str(round(d)) + 'm'
+
+class ElevationProfile(Gtk.Popover):
+	def __init__(self, width, height, on_hover=None, on_leave=None):
+		""" on_hover(lat, lon) is called as the mouse moves over the chart, at
+		most once a frame, and on_leave() when it goes """
+		Gtk.Popover.__init__(self, margin=10)
+		self.width = width
+		self.on_hover = on_hover
+		self.on_leave = on_leave
+		self.track = None
+		self.background = None
+		self.hover_x = None
+		self.tick = None
+
+		# Not pyplot, which would keep every figure ever made
+		self.figure = Figure(dpi=50, facecolor='#aaaaaa')
+		self.axes = self.figure.add_subplot()
+		self.axes.set_facecolor('#aaaaaa')
+		self.area = Polygon(np.zeros((0, 2)), closed=True, facecolor='C0')
+		self.axes.add_patch(self.area)
+		self.climb = self.axes.text(.02, .85, '', transform=self.axes.transAxes, fontsize=16)
+		# Cursor artists are animated so they are left out of full draws and blitted on hover
+		self.cursor = self.axes.axvline(color='#000000', lw=0.8, animated=True)
+		self.label = self.axes.text(.98, .65, '', transform=self.axes.transAxes, fontsize=18, fontweight='bold', horizontalalignment='right', animated=True)
+
+		self.canvas = FigureCanvas(self.figure)
+		self.set_size_request(width, height)
+		self.add(self.canvas)
+		self.set_position(Gtk.PositionType.RIGHT)
+
+		self.canvas.mpl_connect('figure_leave_event', self.leave)
+		self.canvas.mpl_connect('motion_notify_event', self.motion)
+		self.canvas.mpl_connect('draw_event', self.save_background)
+
+	def show_track(self, track):
+		""" Plots a Track, reduced to about a point per pixel. The full track
+		is kept for the hover readout and the climb figures. """
+		self.track = track
+		keep = lttb(track.dist, track.ele, self.width)
+		x = track.dist[keep]
+		y = track.ele[keep]
+		self.area.set_xy(np.column_stack((np.concatenate(([x[0]], x, [x[-1]])), np.concatenate(([0], y, [0])))))
+		self.axes.set_xlim(0, x[-1])
+		self.axes.set_ylim(0, max(float(y.max()), 1) * 1.05)
+		ascent, descent = track.climb()
+		self.climb.set_text('\u2191' + str(round(ascent)) + 'm  \u2193' + str(round(descent)) + 'm')
+		self.label.set_text('')
+		self.background = None
+		self.canvas.draw_idle()
+		self.show_all()
+		self.popup()
+
+	def clear(self):
+		""" Lets go of the track, e.g. when the route changes """
+		self.track = None
+		self.popdown()
+
+	def save_background(self, event):
+		""" Keeps a copy of the static chart after each full draw, for blitting """
+		self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+		self.axes.draw_artist(self.cursor)
+		self.axes.draw_artist(self.label)
+
+	def motion(self, event):
+		if event.xdata is not None and self.track is not None:
+			self.hover_x = event.xdata
+			# Only redraw once per frame however fast the mouse moves
+			if self.tick is None:
+				self.tick = self.canvas.add_tick_callback(self.draw_hover)
+
+	def leave(self, event):
+		# A redraw still waiting for the next frame would put the crosshairs back
+		if self.tick is not None:
+			self.canvas.remove_tick_callback(self.tick)
+			self.tick = None
+		self.hover_x = None
+		if self.on_leave is not None:
+			self.on_leave()
+
+	def draw_hover(self, canvas, frame_clock):
+		""" Moves the cursor line and label to the latest hover position """
+		self.tick = None
+		if self.track is None or self.hover_x is None:
+			return GLib.SOURCE_REMOVE
+		x = self.hover_x
+		lat, lon, elev = self.track.locate(x)
+		if self.on_hover is not None:
+			self.on_hover(lat, lon)
+		self.label.set_text(str(round(elev)) + 'm\n' + distance_text(x))
+		self.cursor.set_xdata([x, x])
+
+		if self.background is None:
+			canvas.draw()
+		else:
+			canvas.restore_region(self.background)
+			self.axes.draw_artist(self.cursor)
+			self.axes.draw_artist(self.label)
+			canvas.blit(self.figure.bbox)
+		return GLib.SOURCE_REMOVE
@@ -0,0 +1,132 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" GPS recording: every fix to a journal on disk, a bounded trail in memory
+
+Journals are text, one fix per line as "time lat lon ele". A crash can at
+worst leave a torn last line, which reading skips. To save one as GPX:
+
+	python3 recorder.py track.journal track.gpx
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import gpxio
+import simplify
+
+# Fixes written (and synced) together
+BATCH = 10
+# Points kept in memory for drawing a recording
+TRAIL_SIZE = 20000
+
+def journal_path(directory):
+	""" New journal named for the time now """
+	os.makedirs(directory, exist_ok=True)
+	return os.path.join(directory, time.strftime('%Y%m%d-%H%M%S') + '.journal')
+
+class Journal:
+	def __init__(self, path, batch=BATCH):
+		""" Appends to path, flushing to disk every batch fixes """
+		self.path = path
+		self.batch = batch
+		self.pending = []
+		self.file = open(path, 'a', encoding='utf-8')
+
+	def append(self, t, lat, lon, ele=None):
+		self.pending.append('%.3f %r %r %r\n' % (t, float(lat), float(lon), float('nan') if ele is None else float(ele)))
+		if len(self.pending) >= self.batch:
+			self.flush()
+
+	def flush(self):
+		if self.pending:
+			self.file.write(''.join(self.pending))
+			self.file.flush()
+			os.fsync(self.file.fileno())
+			self.pending = []
+
+	def close(self):
+		self.flush()
+		self.file.close()
+
+def read_journal(path, chunk=gpxio.WRITE_CHUNK):
+	""" Yields (lat, lon, ele, times) arrays of up to chunk fixes """
+	rows = []
+	with open(path, encoding='utf-8') as f:
+		for line in f:
+			try:
+				t, lat, lon, ele = map(float, line.split())
+			except ValueError:
+				continue
+			rows.append((lat, lon, ele, t))
+			if len(rows) == chunk:
+				a = np.array(rows)
+				yield a[:,0], a[:,1], a[:,2], a[:,3]
+				rows = []
+	if rows:
+		a = np.array(rows)
+		yield a[:,0], a[:,1], a[:,2], a[:,3]
+
+def journal_to_gpx(path, gpx_path, name='GPS Track', precision=None, progress=None):
+	""" Converts a journal a chunk at a time, so any length fits in memory """
+	return gpxio.write_chunks(gpx_path, read_journal(path), name, precision, progress)
+
+class Trail:
+	""" The points of a recording for drawing, in fixed memory.
+
+	When full, the older half is thinned with Douglas-Peucker at a tolerance
+	that doubles until at least half of it goes. The whole trip stays on the
+	map, with full detail near the current position.
+	"""
+	def __init__(self, size=TRAIL_SIZE, tolerance=1.0):
+		self.lat = np.empty(size)
+		self.lon = np.empty(size)
+		self.n = 0
+		self.tolerance = tolerance
+
+	def __len__(self):
+		return self.n
+
+	def append(self, lat, lon):
+		""" True if the trail had to be thinned to fit it in """
+		thinned = self.n == len(self.lat)
+		if thinned:
+			self.thin()
+		self.lat[self.n] = lat
+		self.lon[self.n] = lon
+		self.n = self.n + 1
+		return thinned
+
+	def thin(self):
+		half = self.n // 2
+		imp = simplify.importance(self.lat[:half + 1], self.lon[:half + 1], self.tolerance)
+		keep = np.flatnonzero(imp > self.tolerance)
+		while len(keep) > half // 2:
+			self.tolerance = self.tolerance * 2
+			keep = np.flatnonzero(imp > self.tolerance)
+		keep = np.concatenate((keep, np.arange(half + 1, self.n)))
+		self.n = len(keep)
+		self.lat[:self.n] = self.lat[keep]
+		self.lon[:self.n] = self.lon[keep]
+
+	def points(self):
+		return self.lat[:self.n], self.lon[:self.n]
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		sys.exit('usage: recorder.py JOURNAL GPX')
+	print(journal_to_gpx(sys.argv[1], sys.argv[2]), 'points')
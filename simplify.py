@@ -0,0 +1,131 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Polyline simplification """
+
+import numpy as np
+from geometry import EARTH_RADIUS, RAD
+
+# Metres per pixel at zoom 0 on the equator for 256px web mercator tiles
+ZOOM0_RESOLUTION = 2 * np.pi * EARTH_RADIUS / 256
+
+def resolution(zoom, lat):
+	""" Ground metres per screen pixel """
+	return ZOOM0_RESOLUTION * np.cos(lat * RAD) / 2 ** zoom
+
+def project(lat, lon):
+	""" Flat x, y in metres, good enough for simplifying one track """
+	lat = np.asarray(lat, dtype=float)
+	lon = np.asarray(lon, dtype=float)
+	k = np.cos(np.nanmean(lat) * RAD) if len(lat) else 1.0
+	return lon * RAD * EARTH_RADIUS * k, lat * RAD * EARTH_RADIUS
+
+def segment_distance(x, y, x1, y1, x2, y2):
+	""" Distances of points x, y from the segment (x1, y1)-(x2, y2) """
+	dx = x2 - x1
+	dy = y2 - y1
+	l2 = dx * dx + dy * dy
+	if l2 > 0:
+		t = np.clip(((x - x1) * dx + (y - y1) * dy) / l2, 0, 1)
+	else:
+		t = 0
+	px = x - (x1 + t * dx)
+	py = y - (y1 + t * dy)
+	return np.sqrt(px * px + py * py)
+
+def importance(lat, lon, floor=0.0):
+	""" Douglas-Peucker run once to the bottom.
+
+	Each vertex gets the tolerance below which it is kept, so simplifying to
+	any tolerance is just importance > tolerance. Ranges whose furthest
+	vertex is within floor metres are not split any further.
+	"""
+	x, y = project(lat, lon)
+	n = len(x)
+	imp = np.zeros(n)
+	if n == 0:
+		return imp
+	imp[0] = imp[-1] = np.inf
+	stack = [(0, n - 1, np.inf)]
+	while stack:
+		first, last, parent = stack.pop()
+		if last - first < 2:
+			continue
+		d = segment_distance(x[first+1:last], y[first+1:last], x[first], y[first], x[last], y[last])
+		i = int(np.argmax(d))
+		dmax = d[i]
+		if dmax <= floor:
+			continue
+		i = first + 1 + i
+		# Never more important than the range it split, so levels nest
+		imp[i] = min(dmax, parent)
+		stack.append((first, i, imp[i]))
+		stack.append((i, last, imp[i]))
+	return imp
+
+def douglas_peucker(lat, lon, tolerance):
+	""" Indices of the vertices kept at tolerance metres """
+	return np.flatnonzero(importance(lat, lon, tolerance) > tolerance)
+
+class Pyramid:
+	""" Vertex indices of a track to draw at each map zoom level """
+	def __init__(self, lat, lon, pixels=1.0, max_zoom=20):
+		self.pixels = pixels
+		self.lat = float(np.nanmean(lat)) if len(lat) else 0.0
+		self.importance = importance(lat, lon, self.tolerance(max_zoom))
+		self.levels = {}
+
+	def tolerance(self, zoom):
+		return resolution(zoom, self.lat) * self.pixels
+
+	def level(self, zoom):
+		try:
+			return self.levels[zoom]
+		except KeyError:
+			idx = self.levels[zoom] = np.flatnonzero(self.importance > self.tolerance(zoom))
+			return idx
+
+def lttb(x, y, n):
+	""" Indices of n points chosen by Largest-Triangle-Three-Buckets.
+
+	For plotting a series at about one point per pixel: the inner points are
+	split into n - 2 buckets and from each the one making the largest
+	triangle with the last pick and the next bucket's mean is kept, so
+	peaks and troughs survive where a plain stride would skip them.
+	"""
+	x = np.asarray(x, dtype=float)
+	y = np.asarray(y, dtype=float)
+	length = len(x)
+	if n >= length or n < 3:
+		return np.arange(length)
+	edges = np.linspace(1, length - 1, n - 1).astype(int)
+	counts = np.diff(edges)
+	# The last bucket ends before the final point, which is its own bucket
+	mean_x = np.append(np.add.reduceat(x[:length - 1], edges[:-1]) / counts, x[-1])
+	mean_y = np.append(np.add.reduceat(y[:length - 1], edges[:-1]) / counts, y[-1])
+	idx = np.empty(n, dtype=int)
+	idx[0] = 0
+	idx[-1] = length - 1
+	a = 0
+	for b in range(n - 2):
+		lo = edges[b]
+		hi = edges[b + 1]
+		cx = mean_x[b + 1]
+		cy = mean_y[b + 1]
+		area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+		a = lo + int(np.argmax(area))
+		idx[b + 1] = a
+	return idx
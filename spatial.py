@@ -0,0 +1,227 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Grid index for finding the track vertices near a point """
+
+import math
+import numpy as np
+import geometry
+from geometry import EARTH_RADIUS, RAD
+
+class GridIndex:
+	""" Points bucketed into square cells of cell metres.
+
+	Coordinates are projected flat around the latitude of the first point,
+	which is fine over the size of a route. Queries only look at cells near
+	the point, so cost depends on how crowded they are, not on the track length.
+	"""
+	def __init__(self, lat0, cell=50.0):
+		self.k = math.cos(lat0 * RAD)
+		self.cell = cell
+		self.cells = {}
+		self.pos = {}
+
+	@classmethod
+	def from_arrays(cls, lat, lon, cell=50.0):
+		""" Index of a whole track, with ids 0..n-1 """
+		index = cls(float(lat[0]) if len(lat) else 0.0, cell)
+		lat = np.asarray(lat, dtype=float)
+		lon = np.asarray(lon, dtype=float)
+		x = lon * RAD * EARTH_RADIUS * index.k
+		y = lat * RAD * EARTH_RADIUS
+		cx = np.floor(x / cell).astype(int).tolist()
+		cy = np.floor(y / cell).astype(int).tolist()
+		x = x.tolist()
+		y = y.tolist()
+		lat = lat.tolist()
+		lon = lon.tolist()
+		cells = index.cells
+		for i in range(len(x)):
+			index.pos[i] = (x[i], y[i], lat[i], lon[i])
+			cells.setdefault((cx[i], cy[i]), []).append(i)
+		return index
+
+	def project(self, lat, lon):
+		return lon * RAD * EARTH_RADIUS * self.k, lat * RAD * EARTH_RADIUS
+
+	def key(self, x, y):
+		return math.floor(x / self.cell), math.floor(y / self.cell)
+
+	def __len__(self):
+		return len(self.pos)
+
+	def insert(self, i, lat, lon):
+		x, y = self.project(lat, lon)
+		self.pos[i] = (x, y, lat, lon)
+		self.cells.setdefault(self.key(x, y), []).append(i)
+
+	def remove(self, i):
+		x, y, lat, lon = self.pos.pop(i)
+		key = self.key(x, y)
+		ids = self.cells[key]
+		ids.remove(i)
+		if not ids:
+			del self.cells[key]
+
+	def move(self, i, lat, lon):
+		self.remove(i)
+		self.insert(i, lat, lon)
+
+	def rings(self, lat, lon, radius):
+		""" Yields the ids in each ring of cells around the point, with the
+		least distance any of them can be from it """
+		x, y = self.project(lat, lon)
+		cx, cy = self.key(x, y)
+		limit = radius / self.cell + 1
+		r = 0
+		seen = 0
+		while seen < len(self.pos) and r <= limit:
+			near = max(r - 1, 0) * self.cell
+			if 8 * r > len(self.cells):
+				# Sparse beyond here, quicker to sweep the rest than walk rings
+				ids = []
+				for key, cell in self.cells.items():
+					if max(abs(key[0] - cx), abs(key[1] - cy)) >= r:
+						ids.extend(cell)
+				yield ids, near
+				return
+			ids = []
+			if r == 0:
+				ids.extend(self.cells.get((cx, cy), ()))
+			else:
+				for dx in range(-r, r + 1):
+					ids.extend(self.cells.get((cx + dx, cy - r), ()))
+					ids.extend(self.cells.get((cx + dx, cy + r), ()))
+				for dy in range(-r + 1, r):
+					ids.extend(self.cells.get((cx - r, cy + dy), ()))
+					ids.extend(self.cells.get((cx + r, cy + dy), ()))
+			seen = seen + len(ids)
+			yield ids, near
+			r = r + 1
+
+	def within(self, lat, lon, radius):
+		""" [(id, metres)] of points within radius, nearest first """
+		found = []
+		for ids, near in self.rings(lat, lon, radius):
+			for i in ids:
+				d = geometry.distance((lat, lon), self.pos[i][2:])
+				if d <= radius:
+					found.append((d, i))
+		found.sort()
+		return [(i, d) for d, i in found]
+
+	def nearest(self, lat, lon, radius=float('inf')):
+		""" (id, metres) of the nearest point within radius, or (None, inf) """
+		best = None
+		bestDist = float('inf')
+		for ids, near in self.rings(lat, lon, radius):
+			# Nothing in this ring or beyond can beat what has been found
+			if near > bestDist:
+				break
+			for i in ids:
+				d = geometry.distance((lat, lon), self.pos[i][2:])
+				if d < bestDist and d <= radius:
+					best = i
+					bestDist = d
+		return best, bestDist
+
+def nearest_on_track(index, lat, lon, pt, longest, limit=256):
+	""" nearest_on_polyline() of pt on the track lat, lon, using its GridIndex.
+
+	The segments either side of the nearest vertex give a first answer, at
+	distance d. A segment with a nearer point must have an end within
+	sqrt(d^2 + (longest/2)^2) of pt, longest being the longest segment, so
+	only the segments touching vertices within that radius are checked. If
+	there are more than limit of those, as on a sparse route, the whole track
+	is searched instead.
+	"""
+	v = index.nearest(pt[0], pt[1])[0]
+	if v is None:
+		return None, 0.0, float('inf')
+	a = max(v - 1, 0)
+	i, t, d = geometry.nearest_on_polyline(lat[a:v+2], lon[a:v+2], pt)
+	best = (d, a + i, t)
+	near = index.within(pt[0], pt[1], math.sqrt(d * d + longest * longest / 4))
+	if len(near) > limit:
+		return geometry.nearest_on_polyline(lat, lon, pt)
+	for c, dc in near:
+		a = max(c - 1, 0)
+		i, t, d = geometry.nearest_on_polyline(lat[a:c+2], lon[a:c+2], pt)
+		best = min(best, (d, a + i, t))
+	d, i, t = best
+	return i, t, d
+
+class TrackIndex:
+	""" GridIndex of a track whose points are inserted, moved and removed by
+	position, as on an editable MapTrack. Ids stay fixed, a list maps
+	positions to them and a dict maps them back. Appending keeps the dict up
+	to date; after an insert or remove in the middle the positions from there
+	on are renumbered at the next lookup. """
+	def __init__(self, cell=30.0):
+		self.cell = cell
+		self.grid = None
+		self.ids = []
+		self.positions = {}
+		# First position whose entry in positions may be out of date
+		self.stale = None
+		self.next = 0
+
+	def __len__(self):
+		return len(self.ids)
+
+	def insert(self, position, lat, lon):
+		if self.grid is None:
+			self.grid = GridIndex(lat, self.cell)
+		self.grid.insert(self.next, lat, lon)
+		if position >= len(self.ids):
+			self.positions[self.next] = len(self.ids)
+			self.ids.append(self.next)
+		else:
+			self.ids.insert(position, self.next)
+			self.renumber(position)
+		self.next = self.next + 1
+
+	def append(self, lat, lon):
+		self.insert(len(self.ids), lat, lon)
+
+	def move(self, position, lat, lon):
+		self.grid.move(self.ids[position], lat, lon)
+
+	def remove(self, position):
+		i = self.ids.pop(position)
+		self.grid.remove(i)
+		self.positions.pop(i, None)
+		self.renumber(position)
+
+	def renumber(self, position):
+		self.stale = position if self.stale is None else min(self.stale, position)
+
+	def position(self, i):
+		""" Where id i is in the track """
+		if self.stale is not None:
+			for p in range(self.stale, len(self.ids)):
+				self.positions[self.ids[p]] = p
+			self.stale = None
+		return self.positions[i]
+
+	def nearest(self, lat, lon, radius=float('inf')):
+		""" (position, metres) of the nearest point within radius, or (None, inf) """
+		if self.grid is None:
+			return None, float('inf')
+		i, d = self.grid.nearest(lat, lon, radius)
+		if i is None:
+			return None, d
+		return self.position(i), d
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Local stand-ins for the ORS directions and elevation APIs and Nominatim,
+for benchmarks and for trying the map offline
+
+	python3 standins.py 8080
+	DONMAPS_ORS=http://127.0.0.1:8080 DONMAPS_NOMINATIM=http://127.0.0.1:8080 python3 map.py
+
+Replies have the shape of the real ones but made-up content: routes go in
+straight lines between the waypoints with a point every ROUTE_SPACING
+metres, heights are a smooth function of position, and every search finds
+the same few places. Everything is deterministic, so runs can be compared.
+"""
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import geometry
+
+# Metres between route points
+ROUTE_SPACING = 10
+# Places a search returns
+PLACES = 8
+
+def height(lat, lon):
+	""" Made-up ground height in metres """
+	return 200 + 150 * np.sin(np.asarray(lat) * 40) * np.cos(np.asarray(lon) * 30)
+
+def route(coordinates, spacing=ROUTE_SPACING):
+	""" ORS directions GeoJSON for [[lon, lat], ...] waypoints """
+	wpts = np.asarray(coordinates, dtype=float)
+	lon = [wpts[:1,0]]
+	lat = [wpts[:1,1]]
+	way_points = [0]
+	steps = []
+	for i in range(1, len(wpts)):
+		d = geometry.distance(wpts[i - 1, ::-1], wpts[i, ::-1])
+		n = max(int(d // spacing), 1)
+		t = np.arange(1, n + 1) / n
+		lon.append(wpts[i - 1, 0] + t * (wpts[i, 0] - wpts[i - 1, 0]))
+		lat.append(wpts[i - 1, 1] + t * (wpts[i, 1] - wpts[i - 1, 1]))
+		steps.append({'distance': round(d, 1), 'duration': round(d / 10, 1), 'instruction': 'Head to waypoint %d' % i, 'way_points': [way_points[-1], way_points[-1] + n]})
+		way_points.append(way_points[-1] + n)
+	lon = np.concatenate(lon)
+	lat = np.concatenate(lat)
+	ele = np.round(height(lat, lon), 1)
+	coords = np.column_stack((np.round(lon, 6), np.round(lat, 6), ele)).tolist()
+	distance = sum(step['distance'] for step in steps)
+	return {
+		'type': 'FeatureCollection',
+		'bbox': [float(lon.min()), float(lat.min()), float(ele.min()), float(lon.max()), float(lat.max()), float(ele.max())],
+		'features': [{
+			'type': 'Feature',
+			'bbox': [float(lon.min()), float(lat.min()), float(ele.min()), float(lon.max()), float(lat.max()), float(ele.max())],
+			'properties': {
+				'segments': [{'distance': distance, 'duration': round(distance / 10, 1), 'steps': steps}],
+				'summary': {'distance': distance, 'duration': round(distance / 10, 1)},
+				'way_points': way_points,
+			},
+			'geometry': {'type': 'LineString', 'coordinates': coords},
+		}],
+	}
+
+def elevation_line(line):
+	""" ORS /elevation/line reply for polyline [[lon, lat], ...] in and out """
+	a = np.asarray(line, dtype=float).reshape(-1, 2)
+	ele = np.round(height(a[:,1], a[:,0]), 1)
+	return {'attribution': 'stand-in', 'geometry': np.column_stack((a, ele)).tolist(), 'version': '0'}
+
+def places(q, limit=PLACES):
+	""" Nominatim search reply. A "lat,lon" query finds places around it. """
+	try:
+		lat, lon = map(float, q.split(','))
+	except ValueError:
+		lat, lon = 51.5, -0.1
+	found = []
+	for i in range(limit):
+		found.append({
+			'place_id': i + 1,
+			'lat': '%.7f' % (lat + i * 0.001),
+			'lon': '%.7f' % (lon + i * 0.001),
+			'display_name': '%d %s, Standin Town, Standinshire, United Kingdom' % (i + 1, q),
+			'class': 'place',
+			'type': 'house',
+			'importance': round(1 - i / limit, 3),
+			'address': {'house_number': str(i + 1), 'road': q, 'town': 'Standin Town', 'country': 'United Kingdom', 'country_code': 'gb'},
+		})
+	return found
+
+class StandIns:
+	""" All three APIs on one local port """
+	def __init__(self, port=0):
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			# Headers and body go in separate writes, which Nagle would hold up
+			disable_nagle_algorithm = True
+
+			def reply(self, body):
+				data = json.dumps(body).encode()
+				self.send_response(200)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+			def do_GET(self):
+				url = urlsplit(self.path)
+				query = parse_qs(url.query)
+				if 'q' not in query:
+					self.send_error(400)
+					return
+				limit = int(query.get('limit', [PLACES])[0])
+				self.reply(places(query['q'][0], limit))
+
+			def do_POST(self):
+				try:
+					body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+					if self.path.startswith('/v2/directions/'):
+						self.reply(route(body['coordinates']))
+					elif self.path.startswith('/elevation/line'):
+						self.reply(elevation_line(body['geometry']))
+					else:
+						self.send_error(404)
+				except (ValueError, KeyError, IndexError):
+					self.send_error(400)
+
+			def log_message(self, *args):
+				pass
+
+		self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+		self.httpd.daemon_threads = True
+		self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+	def start(self):
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+		return self
+
+	def shutdown(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+if __name__ == '__main__':
+	server = StandIns(int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+	print('ORS and Nominatim stand-ins on', server.url)
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,55 @@
+""" geometry against the scalar distance_between that map.py used to have """
+
+import math
+import numpy as np
+import geometry
+
+def distance_between(latlng1, latlng2):
+	""" The old UI.distance_between, unchanged """
+	rad = 3.14159265358979323846264338327950288 / 180
+	lat1 = latlng1[0] * rad
+	lat2 = latlng2[0] * rad
+	sinDLat = math.sin((latlng2[0] - latlng1[0]) * rad / 2)
+	sinDLon = math.sin((latlng2[1] - latlng1[1]) * rad / 2)
+	a = sinDLat * sinDLat + math.cos(lat1) * math.cos(lat2) * sinDLon * sinDLon
+	c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+	return 6378137 * c
+
+def points(n, seed=0):
+	rng = np.random.default_rng(seed)
+	lat = rng.uniform(-90, 90, n)
+	lon = rng.uniform(-180, 180, n)
+	# Identical and antipodal pairs among the random ones
+	lat[10], lon[10] = lat[9], lon[9]
+	lat[20], lon[20] = -lat[19], lon[19] + 180
+	lat[30], lon[30] = 0.0, 0.0
+	lat[31], lon[31] = 0.0, 180.0
+	lat[40], lon[40] = 90.0, 0.0
+	lat[41], lon[41] = -90.0, 0.0
+	return lat, lon
+
+def test_haversine():
+	lat1, lon1 = points(200, 1)
+	lat2, lon2 = points(200, 2)
+	lat2[:5], lon2[:5] = lat1[:5], lon1[:5]
+	lat2[5:8], lon2[5:8] = -lat1[5:8], lon1[5:8] + 180
+	expected = [distance_between((lat1[i], lon1[i]), (lat2[i], lon2[i])) for i in range(200)]
+	np.testing.assert_allclose(geometry.haversine(lat1, lon1, lat2, lon2), expected, rtol=1e-9, atol=1e-6)
+	assert geometry.distance((lat1[0], lon1[0]), (lat1[0], lon1[0])) == 0
+
+def test_segment_lengths():
+	lat, lon = points(200)
+	expected = [distance_between((lat[i], lon[i]), (lat[i + 1], lon[i + 1])) for i in range(199)]
+	np.testing.assert_allclose(geometry.segment_lengths(lat, lon), expected, rtol=1e-9, atol=1e-6)
+	assert geometry.segment_lengths(lat, lon)[9] == 0
+
+def test_cumulative_distance():
+	lat, lon = points(200)
+	d = 0
+	expected = [0]
+	for i in range(1, 200):
+		d = d + distance_between((lat[i - 1], lon[i - 1]), (lat[i], lon[i]))
+		expected.append(d)
+	np.testing.assert_allclose(geometry.cumulative_distance(lat, lon), expected, rtol=1e-9, atol=1e-6)
+	assert len(geometry.cumulative_distance([], [])) == 0
+	assert list(geometry.cumulative_distance([51.5], [-0.1])) == [0]
@@ -0,0 +1,44 @@
+""" lttb against a plain loop version """
+
+import numpy as np
+from simplify import lttb
+
+def loop_lttb(x, y, n):
+	""" Largest-Triangle-Three-Buckets one point at a time, buckets as lttb() makes them """
+	length = len(x)
+	edges = [int(e) for e in np.linspace(1, length - 1, n - 1)]
+	buckets = [list(range(edges[b], edges[b + 1])) for b in range(n - 2)] + [[length - 1]]
+	means = [(sum(x[i] for i in bucket) / len(bucket), sum(y[i] for i in bucket) / len(bucket)) for bucket in buckets]
+	picked = [0]
+	a = 0
+	for b in range(n - 2):
+		cx, cy = means[b + 1]
+		best = None
+		for i in buckets[b]:
+			area = abs((x[a] - cx) * (y[i] - y[a]) - (x[a] - x[i]) * (cy - y[a]))
+			if best is None or area > best:
+				best = area
+				a_next = i
+		a = a_next
+		picked.append(a)
+	picked.append(length - 1)
+	return picked, means
+
+def test_last_bucket_mean():
+	# Buckets [1, 3), [3, 6), [6, 9) and the last point: means 1.5, 4, 7, 9
+	x = np.arange(10, dtype=float)
+	picked, means = loop_lttb(x, x, 5)
+	assert [m[0] for m in means] == [1.5, 4.0, 7.0, 9.0]
+	assert list(lttb(x, x, 5)) == picked
+
+def test_matches_loop():
+	rng = np.random.default_rng(0)
+	for length, n in ((10, 5), (101, 7), (1000, 50), (1234, 700), (50, 49)):
+		x = np.cumsum(rng.random(length))
+		y = rng.normal(0, 10, length).cumsum()
+		picked, means = loop_lttb(x, y, n)
+		assert list(lttb(x, y, n)) == picked
+
+def test_short():
+	assert list(lttb([0, 1, 2], [0, 1, 0], 5)) == [0, 1, 2]
+	assert list(lttb(np.arange(10), np.arange(10), 2)) == list(range(10))
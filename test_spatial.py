@@ -0,0 +1,92 @@
+""" TrackIndex and RunningLength kept in step with a plot being edited,
+checked against brute force """
+
+import random
+import numpy as np
+import geometry
+from spatial import GridIndex, TrackIndex, nearest_on_track
+from track import RunningLength
+
+def random_point(rng):
+	return 51.5 + rng.random() * 0.01, -0.1 + rng.random() * 0.01
+
+def test_edits_match_brute_force():
+	rng = random.Random(0)
+	index = TrackIndex()
+	length = RunningLength()
+	pts = []
+	for step in range(1000):
+		op = rng.random()
+		if op < 0.4 or len(pts) < 2:
+			pt = random_point(rng)
+			pts.append(pt)
+			index.append(*pt)
+			length.append(*pt)
+		elif op < 0.65:
+			i = rng.randrange(len(pts) + 1)
+			pt = random_point(rng)
+			pts.insert(i, pt)
+			index.insert(i, *pt)
+			length.insert(i, *pt)
+		elif op < 0.85:
+			i = rng.randrange(len(pts))
+			pts.pop(i)
+			index.remove(i)
+			length.remove(i)
+		else:
+			i = rng.randrange(len(pts))
+			pt = random_point(rng)
+			pts[i] = pt
+			index.move(i, *pt)
+			length.move(i, *pt)
+
+		assert len(index) == len(length) == len(pts)
+		# Not every step, so edits also pile up between lookups
+		if step % 4:
+			continue
+		expected = sum(geometry.distance(pts[k], pts[k + 1]) for k in range(len(pts) - 1))
+		assert abs(length.get_length() - expected) < 1e-6 * max(expected, 1)
+		if pts:
+			q = random_point(rng)
+			best = min(range(len(pts)), key=lambda k: geometry.distance(q, pts[k]))
+			i, d = index.nearest(*q)
+			assert abs(d - geometry.distance(q, pts[best])) < 1e-9
+			assert pts[i] == pts[best] or abs(geometry.distance(q, pts[i]) - d) < 1e-9
+
+def test_remove_after_insert():
+	index = TrackIndex()
+	index.append(50, -5)
+	index.append(50.001, -5)
+	index.insert(1, 50.0005, -5)
+	index.remove(1)
+	assert index.nearest(50.001, -5)[0] == 1
+
+def check_nearest_on_track(lat, lon, queries):
+	index = GridIndex.from_arrays(lat, lon)
+	longest = float(geometry.segment_lengths(lat, lon).max())
+	for pt in queries:
+		i, t, d = nearest_on_track(index, lat, lon, pt, longest)
+		expected = geometry.nearest_on_polyline(lat, lon, pt)[2]
+		assert abs(d - expected) < 1e-6
+
+def test_nearest_on_track_dense():
+	rng = np.random.default_rng(0)
+	heading = np.cumsum(rng.normal(0, 0.3, 2000))
+	lat = 51.5 + np.cumsum(np.cos(heading)) * 1e-4
+	lon = -0.1 + np.cumsum(np.sin(heading)) * 1.6e-4
+	queries = np.column_stack((rng.uniform(lat.min(), lat.max(), 200), rng.uniform(lon.min(), lon.max(), 200))).tolist()
+	check_nearest_on_track(lat, lon, queries)
+
+def test_nearest_on_track_sparse_out_and_back():
+	# A long straight leg out with vertices km apart, and a dense one back
+	# alongside it, so a vertex on the way back is nearer than the ends of
+	# the long segment
+	out = np.linspace(51.0, 51.1, 3)
+	back = np.linspace(51.1, 51.0, 500)
+	lat = np.concatenate((out, back))
+	lon = np.concatenate((np.zeros(3), np.full(500, 0.002)))
+	queries = [(51.025, 0.0001), (51.075, 0.0002), (51.05, 0.0009), (51.05, 0.0012)]
+	check_nearest_on_track(lat, lon, queries)
+	index = GridIndex.from_arrays(lat, lon)
+	longest = float(geometry.segment_lengths(lat, lon).max())
+	assert nearest_on_track(index, lat, lon, (51.025, 0.0001), longest)[0] == 0
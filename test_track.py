@@ -0,0 +1,19 @@
+""" Track climb figures """
+
+import numpy as np
+from track import Track
+
+def track(ele):
+	n = len(ele)
+	return Track(np.linspace(51, 51.01, n), np.zeros(n), ele)
+
+def test_climb():
+	assert track([5, 15, 10, 12]).climb() == (12.0, 5.0)
+
+def test_climb_bridges_missing_elevations():
+	assert track([5, np.nan, 15]).climb() == (10.0, 0.0)
+	assert track([np.nan, 20, np.nan, np.nan, 10, 12, np.nan]).climb() == (2.0, 10.0)
+
+def test_climb_without_elevations():
+	assert track([np.nan, np.nan]).climb() == (0.0, 0.0)
+	assert Track(np.zeros(0), np.zeros(0)).climb() == (0.0, 0.0)
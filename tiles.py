@@ -0,0 +1,205 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Map tiles along a route, and downloading them into a tile cache """
+
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from geometry import EARTH_RADIUS, RAD
+import network
+
+# Guess at the size of a tile when there are none on disk to go by
+TILE_BYTES = 20000
+
+def tile_xy(lat, lon, zoom):
+	""" Fractional web mercator tile coordinates """
+	n = 2 ** zoom
+	lat = np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511) * RAD
+	x = (np.asarray(lon, dtype=float) + 180) / 360 * n
+	y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n
+	return x, y
+
+def tile_metres(zoom, lat):
+	""" Ground width of a tile """
+	return 2 * np.pi * EARTH_RADIUS * np.cos(lat * RAD) / 2 ** zoom
+
+def corridor(lat, lon, zoom, buffer):
+	""" (x, y) array of the tiles at zoom within about buffer metres of the polyline """
+	lat = np.asarray(lat, dtype=float)
+	lon = np.asarray(lon, dtype=float)
+	n = 2 ** zoom
+	x, y = tile_xy(lat, lon, zoom)
+	# Sample segments at least every half tile so none are skipped over
+	if len(x) > 1:
+		steps = np.ceil(np.hypot(np.diff(x), np.diff(y)) * 2).astype(int) + 1
+		seg = np.repeat(np.arange(len(x) - 1), steps)
+		t = np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)
+		t = t / np.repeat(steps, steps)
+		x = x[seg] + t * (x[seg + 1] - x[seg])
+		y = y[seg] + t * (y[seg + 1] - y[seg])
+	# Buffer in tiles, from the widest tile on the route
+	b = buffer / tile_metres(zoom, np.nanmax(np.abs(lat)))
+	lo_x = np.floor(x - b).astype(np.int64)
+	hi_x = np.floor(x + b).astype(np.int64)
+	lo_y = np.floor(y - b).astype(np.int64)
+	hi_y = np.floor(y + b).astype(np.int64)
+	w = int((hi_x - lo_x).max()) + 1
+	h = int((hi_y - lo_y).max()) + 1
+	keys = []
+	for dx in range(w):
+		for dy in range(h):
+			tx = lo_x + dx
+			ty = lo_y + dy
+			ok = (tx <= hi_x) & (ty <= hi_y) & (ty >= 0) & (ty < n)
+			keys.append(np.unique((tx[ok] % n) * n + ty[ok]))
+	keys = np.unique(np.concatenate(keys))
+	return np.column_stack((keys // n, keys % n))
+
+def quadkey(x, y, zoom, digits):
+	""" Bing style quadtree address using the four characters in digits """
+	key = []
+	for z in range(zoom, 0, -1):
+		mask = 1 << (z - 1)
+		key.append(digits[(1 if x & mask else 0) + (2 if y & mask else 0)])
+	return ''.join(key)
+
+def tile_url(uri, x, y, zoom, max_zoom):
+	""" Fills in an osm-gps-map repo URI """
+	url = uri.replace('#X', str(x)).replace('#Y', str(y)).replace('#Z', str(zoom))
+	url = url.replace('#S', str(max_zoom - zoom)).replace('#U', str(2 ** zoom - 1 - y))
+	if '#Q' in url:
+		url = url.replace('#Q', quadkey(x, y, zoom, 'qrts'))
+	if '#W' in url:
+		url = url.replace('#W', quadkey(x, y, zoom, '0123'))
+	if '#R' in url:
+		url = url.replace('#R', str(random.randint(0, 3)))
+	return url
+
+def area(lat1, lon1, lat2, lon2, zoom):
+	""" Ranges of x and y of the tiles covering a bbox """
+	x1, y1 = tile_xy(max(lat1, lat2), min(lon1, lon2), zoom)
+	x2, y2 = tile_xy(min(lat1, lat2), max(lon1, lon2), zoom)
+	n = 2 ** zoom
+	return range(int(x1), min(int(x2), n - 1) + 1), range(int(y1), min(int(y2), n - 1) + 1)
+
+class TileDir:
+	""" Tiles as files the way osm-gps-map caches them, cache/z/x/y.fmt """
+	def __init__(self, cache, fmt):
+		self.cache = cache
+		self.fmt = fmt
+
+	def path(self, zoom, x, y):
+		return os.path.join(self.cache, str(zoom), str(x), '%d.%s' % (y, self.fmt))
+
+	def has(self, zoom, x, y):
+		return os.path.exists(self.path(zoom, x, y))
+
+	def put(self, zoom, x, y, data):
+		""" Written to a .part file and renamed, so a tile is there whole or not at all """
+		path = self.path(zoom, x, y)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path + '.part', 'wb') as f:
+			f.write(data)
+		os.replace(path + '.part', path)
+
+	def average_size(self):
+		""" Mean size of tiles already cached, from a sample of them """
+		sizes = []
+		for root, dirs, files in os.walk(self.cache):
+			for name in files[:50]:
+				try:
+					sizes.append(os.path.getsize(os.path.join(root, name)))
+				except OSError:
+					pass
+			if len(sizes) >= 500:
+				break
+		return sum(sizes) / len(sizes) if sizes else TILE_BYTES
+
+def missing(store, tiles, zoom):
+	""" The tiles not already in store """
+	return [(x, y) for x, y in tiles.tolist() if not store.has(zoom, x, y)]
+
+class Downloader:
+	""" Fetches (zoom, x, y) tiles into a store (a TileDir or TileStore) with a
+	few workers.
+
+	Tiles already in the store are skipped, so stopping and starting again
+	just carries on with what's missing. progress(done, total, failed) and
+	finished(done, failed) are called from worker threads.
+	"""
+	def __init__(self, store, uri, max_zoom, tiles, total=None, workers=2, progress=None, finished=None):
+		self.store = store
+		self.uri = uri
+		self.max_zoom = max_zoom
+		self.tiles = tiles
+		self.total = len(tiles) if total is None else total
+		self.workers = workers
+		self.progress = progress
+		self.finished = finished
+		self.done = 0
+		self.failed = 0
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.stopped = False
+
+	def start(self):
+		threading.Thread(target=self.run, daemon=True).start()
+
+	def stop(self):
+		self.stopped = True
+
+	def session(self):
+		try:
+			return self.local.session
+		except AttributeError:
+			session = self.local.session = network.new_session()
+			return session
+
+	def run(self):
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			# Never more than a few queued, so stop() takes effect quickly
+			pending = threading.BoundedSemaphore(self.workers * 2)
+			for tile in self.tiles:
+				if self.stopped:
+					break
+				pending.acquire()
+				future = pool.submit(self.fetch, *tile)
+				future.add_done_callback(lambda f: pending.release())
+		if self.finished is not None:
+			self.finished(self.done, self.failed)
+
+	def fetch(self, zoom, x, y):
+		if self.stopped:
+			return
+		ok = self.store.has(zoom, x, y)
+		if not ok:
+			try:
+				r = self.session().get(tile_url(self.uri, x, y, zoom, self.max_zoom), timeout=network.TIMEOUT)
+				if r.status_code == 200 and r.content:
+					self.store.put(zoom, x, y, r.content)
+					ok = True
+			except Exception:
+				pass
+		with self.lock:
+			if ok:
+				self.done = self.done + 1
+			else:
+				self.failed = self.failed + 1
+			if self.progress is not None:
+				self.progress(self.done, self.total, self.failed)
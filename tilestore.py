@@ -0,0 +1,333 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Map tiles in one MBTiles file per map source, kept within a size budget
+and served to the map over HTTP on localhost """
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import network
+import tiles
+
+# Last-shown times are written in batches rather than on every read
+TOUCH_BATCH = 200
+# Puts between checks of the budget
+EVICT_EVERY = 100
+EVICT_BATCH = 64
+# Sessions kept for fetching from the real servers, each with its own
+# keep-alive connections
+SESSIONS = 4
+
+def tms_row(y, zoom):
+	""" MBTiles numbers rows from the south """
+	return (1 << zoom) - 1 - y
+
+class TileStore:
+	def __init__(self, path, name='', fmt='png', on_put=None):
+		""" An MBTiles file. The tiles table has the standard columns plus when
+		each tile was last shown, so the least recently used can go first.
+		on_put() is called after each tile is added. """
+		self.on_put = on_put
+		self.lock = threading.Lock()
+		self.touched = {}
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, accessed REAL, PRIMARY KEY (zoom_level, tile_column, tile_row))')
+		self.db.execute('CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)')
+		if self.db.execute('SELECT COUNT(*) FROM metadata').fetchone()[0] == 0:
+			self.db.executemany('INSERT INTO metadata VALUES (?, ?)', [
+				('name', name), ('format', fmt), ('type', 'baselayer'), ('version', '1')
+			])
+		self.db.commit()
+		self.count, self.size = self.db.execute('SELECT COUNT(*), TOTAL(LENGTH(tile_data)) FROM tiles').fetchone()
+
+	def key(self, zoom, x, y):
+		return zoom, x, tms_row(y, zoom)
+
+	def has(self, zoom, x, y):
+		with self.lock:
+			return self.db.execute('SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', self.key(zoom, x, y)).fetchone() is not None
+
+	def get(self, zoom, x, y):
+		""" Tile data or None """
+		key = self.key(zoom, x, y)
+		with self.lock:
+			row = self.db.execute('SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', key).fetchone()
+			if row is None:
+				return None
+			self.touched[key] = time.time()
+			if len(self.touched) >= TOUCH_BATCH:
+				self.flush()
+		return row[0]
+
+	def put(self, zoom, x, y, data):
+		self.put_many([(zoom, x, y, data)])
+
+	def put_many(self, items):
+		""" [(zoom, x, y, data)] in one transaction """
+		now = time.time()
+		with self.lock:
+			for zoom, x, y, data in items:
+				key = self.key(zoom, x, y)
+				old = self.db.execute('SELECT LENGTH(tile_data) FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', key).fetchone()
+				if old is None:
+					self.count = self.count + 1
+				else:
+					self.size = self.size - (old[0] or 0)
+				self.db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)', key + (data, now))
+				self.size = self.size + len(data)
+			self.db.commit()
+		if self.on_put is not None:
+			self.on_put(len(items))
+
+	def flush(self):
+		""" Writes out last-shown times. Call with lock held. """
+		if self.touched:
+			self.db.executemany('UPDATE tiles SET accessed = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+				[(t,) + key for key, t in self.touched.items()])
+			self.db.commit()
+			self.touched = {}
+
+	def oldest(self):
+		""" When the least recently shown tile was last shown, or None if empty """
+		with self.lock:
+			self.flush()
+			row = self.db.execute('SELECT MIN(accessed) FROM tiles').fetchone()
+		return row[0]
+
+	def evict(self, n):
+		""" Drops the n least recently shown tiles """
+		with self.lock:
+			self.flush()
+			rows = self.db.execute('SELECT zoom_level, tile_column, tile_row, LENGTH(tile_data) FROM tiles ORDER BY accessed LIMIT ?', (n,)).fetchall()
+			self.db.executemany('DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', [row[:3] for row in rows])
+			self.db.commit()
+			self.count = self.count - len(rows)
+			self.size = self.size - sum(row[3] or 0 for row in rows)
+
+	def average_size(self):
+		return self.size / self.count if self.count else tiles.TILE_BYTES
+
+	def pack(self, directory, fmt, batch=500):
+		""" Moves the files of an osm-gps-map tile cache in, deleting them and
+		their emptied folders. Returns the number of tiles moved. """
+		moved = 0
+		items = []
+		paths = []
+		for root, dirs, files in os.walk(directory, topdown=False):
+			for name in files:
+				path = os.path.join(root, name)
+				stem, ext = os.path.splitext(name)
+				try:
+					zoom = int(os.path.basename(os.path.dirname(root)))
+					x = int(os.path.basename(root))
+					y = int(stem)
+				except ValueError:
+					continue
+				if ext != '.' + fmt:
+					continue
+				try:
+					with open(path, 'rb') as f:
+						items.append((zoom, x, y, f.read()))
+				except OSError:
+					continue
+				paths.append(path)
+				if len(items) >= batch:
+					moved = moved + self.move_in(items, paths)
+					items = []
+					paths = []
+			if items:
+				moved = moved + self.move_in(items, paths)
+				items = []
+				paths = []
+			if root != directory:
+				try:
+					os.rmdir(root)
+				except OSError:
+					pass
+		return moved
+
+	def move_in(self, items, paths):
+		self.put_many(items)
+		for path in paths:
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		return len(items)
+
+	def close(self):
+		with self.lock:
+			self.flush()
+			self.db.close()
+
+class TileCache:
+	def __init__(self, directory, budget):
+		""" A TileStore per map source, directory/<source>.mbtiles, with the
+		least recently shown tiles across all of them dropped to keep the
+		total within budget bytes """
+		self.directory = directory
+		self.budget = budget
+		self.stores = {}
+		self.lock = threading.Lock()
+		self.puts = 0
+		os.makedirs(directory, exist_ok=True)
+		for name in os.listdir(directory):
+			stem, ext = os.path.splitext(name)
+			if ext == '.mbtiles' and stem.isdigit():
+				self.store(int(stem))
+
+	def store(self, source, fmt='png'):
+		with self.lock:
+			try:
+				return self.stores[source]
+			except KeyError:
+				path = os.path.join(self.directory, '%d.mbtiles' % source)
+				store = self.stores[source] = TileStore(path, str(source), fmt, self.added)
+				return store
+
+	def sizes(self):
+		""" {source: bytes} """
+		return {source: store.size for source, store in self.stores.items()}
+
+	def total(self):
+		return sum(self.sizes().values())
+
+	def added(self, n):
+		with self.lock:
+			self.puts = self.puts + n
+			if self.puts < EVICT_EVERY:
+				return
+			self.puts = 0
+		self.evict()
+
+	def evict(self):
+		""" Drops the least recently shown tiles, from whichever source has the
+		oldest, until within budget """
+		while self.total() > self.budget:
+			oldest = [(store.oldest(), source) for source, store in list(self.stores.items()) if store.count]
+			if not oldest:
+				break
+			t, source = min(oldest)
+			self.stores[source].evict(EVICT_BATCH)
+
+	def close(self):
+		for store in list(self.stores.values()):
+			store.close()
+
+# Placeholders in the local URI for each osm-gps-map one, so the map fills in
+# the same values it would for the real server
+TOKENS = (('#Z', 'z'), ('#X', 'x'), ('#Y', 'y'), ('#S', 's'), ('#U', 'u'), ('#Q', 'q'), ('#W', 'w'), ('#R', 'r'))
+
+def parse_quadkey(key, digits):
+	x = y = 0
+	for c in key:
+		i = digits.index(c)
+		x = (x << 1) | (i & 1)
+		y = (y << 1) | (i >> 1)
+	return len(key), x, y
+
+class TileServer:
+	""" Serves /<source>/... from a TileCache, fetching and keeping tiles it
+	doesn't have from the source's real server """
+	def __init__(self, cache):
+		self.cache = cache
+		self.sources = {}
+		# Each request gets a new thread, so sessions are pooled, not per thread
+		self.sessions = queue.LifoQueue()
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				data, fmt = server.tile(self.path)
+				if data is None:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', 'image/' + fmt)
+				self.send_header('Content-Length', str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+			def log_message(self, *args):
+				pass
+
+		self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.httpd.daemon_threads = True
+
+	def start(self):
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+	def add(self, source, uri, fmt, max_zoom):
+		""" Registers a map source by its real repo URI. Returns the local URI
+		to give the map instead, which has the same placeholders. """
+		self.sources[source] = (uri, fmt, max_zoom)
+		self.cache.store(source, fmt)
+		parts = [letter + token for token, letter in TOKENS if token in uri]
+		return 'http://127.0.0.1:%d/%d/%s' % (self.httpd.server_address[1], source, '/'.join(parts))
+
+	def fetch(self, url):
+		""" GETs url with a pooled session, making one if none is free """
+		try:
+			session = self.sessions.get_nowait()
+		except queue.Empty:
+			session = network.new_session()
+		try:
+			return session.get(url, timeout=network.TIMEOUT)
+		finally:
+			if self.sessions.qsize() < SESSIONS:
+				self.sessions.put(session)
+			else:
+				session.close()
+
+	def tile(self, path):
+		""" (data, format) for a request path, or (None, None) """
+		try:
+			parts = path.strip('/').split('/')
+			source = int(parts[0])
+			uri, fmt, max_zoom = self.sources[source]
+			values = {part[0]: part[1:] for part in parts[1:]}
+			if 'q' in values:
+				zoom, x, y = parse_quadkey(values['q'], 'qrts')
+			elif 'w' in values:
+				zoom, x, y = parse_quadkey(values['w'], '0123')
+			else:
+				zoom = int(values['z']) if 'z' in values else max_zoom - int(values['s'])
+				x = int(values['x'])
+				y = int(values['y']) if 'y' in values else tms_row(int(values['u']), zoom)
+		except (ValueError, KeyError, IndexError):
+			return None, None
+		store = self.cache.store(source, fmt)
+		data = store.get(zoom, x, y)
+		if data is None:
+			try:
+				r = self.fetch(tiles.tile_url(uri, x, y, zoom, max_zoom))
+			except Exception:
+				return None, None
+			if r.status_code != 200 or not r.content:
+				return None, None
+			data = r.content
+			store.put(zoom, x, y, data)
+		return data, fmt
+
+	def shutdown(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
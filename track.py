@@ -0,0 +1,158 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Column-wise route / track storage """
+
+import numpy as np
+import geometry
+
+class Track:
+	""" lat, lon, ele and cumulative distance as float64 arrays.
+
+	Missing elevations are NaN. Slicing returns a Track of views on the same
+	arrays, so its dist carries on from the parent's rather than restarting at 0.
+	"""
+	__slots__ = ('lat', 'lon', 'ele', 'dist')
+
+	def __init__(self, lat, lon, ele=None, dist=None):
+		self.lat = np.ascontiguousarray(lat, dtype=float)
+		self.lon = np.ascontiguousarray(lon, dtype=float)
+		if ele is None:
+			self.ele = np.full(len(self.lat), np.nan)
+		else:
+			self.ele = np.ascontiguousarray(ele, dtype=float)
+		if dist is None:
+			self.dist = geometry.cumulative_distance(self.lat, self.lon)
+		else:
+			self.dist = dist
+
+	@classmethod
+	def from_lonlat(cls, coords):
+		""" From [lon, lat(, ele)] lists, as ORS returns them """
+		a = np.array(coords, dtype=float).reshape(len(coords), -1)
+		return cls(a[:,1], a[:,0], a[:,2] if a.shape[1] > 2 else None)
+
+	@classmethod
+	def from_latlon(cls, pts):
+		""" From an n x 2 or n x 3 array of lat, lon(, ele) """
+		a = np.asarray(pts, dtype=float).reshape(len(pts), -1)
+		return cls(a[:,0], a[:,1], a[:,2] if a.shape[1] > 2 else None)
+
+	def __len__(self):
+		return len(self.lat)
+
+	def __getitem__(self, index):
+		if not isinstance(index, slice):
+			return self.lat[index], self.lon[index], self.ele[index]
+		return Track(self.lat[index], self.lon[index], self.ele[index], self.dist[index])
+
+	@property
+	def length(self):
+		return float(self.dist[-1] - self.dist[0]) if len(self.dist) else 0.0
+
+	def has_elevation(self):
+		""" True only if every point has one """
+		return len(self.ele) > 0 and not np.isnan(self.ele).any()
+
+	def with_elevation(self, ele):
+		""" Same points (shared, not copied) with new elevations """
+		return Track(self.lat, self.lon, ele, self.dist)
+
+	def climb(self):
+		""" Total ascent and descent in metres, bridging points without an elevation """
+		e = self.ele[~np.isnan(self.ele)]
+		d = np.diff(e)
+		return float(d[d > 0].sum()), float(-d[d < 0].sum())
+
+	def bbox(self):
+		return geometry.bbox(self.lat, self.lon)
+
+	def columns(self):
+		""" The arrays themselves, for export without copying """
+		return self.lat, self.lon, self.ele
+
+	def locate(self, d):
+		""" lat, lon, ele interpolated at distance d along the track """
+		i, t = geometry.position_at(self.dist, d + self.dist[0])
+		j = min(i + 1, len(self.lat) - 1)
+		lat = self.lat[i] + t * (self.lat[j] - self.lat[i])
+		lon = self.lon[i] + t * (self.lon[j] - self.lon[i])
+		ele = self.ele[i] + t * (self.ele[j] - self.ele[i])
+		return float(lat), float(lon), float(ele)
+
+class RunningLength:
+	""" Length of a polyline being edited point by point.
+
+	Keeps each segment's length so an append, insert, move or delete only
+	re-measures the one or two segments it touches.
+	"""
+	__slots__ = ('pts', 'segs', 'total')
+
+	def __init__(self):
+		self.pts = []
+		self.segs = []
+		self.total = 0.0
+
+	def __len__(self):
+		return len(self.pts)
+
+	def seg(self, i):
+		""" Length from point i to i+1 """
+		return geometry.distance(self.pts[i], self.pts[i + 1])
+
+	def append(self, lat, lon):
+		self.insert(len(self.pts), lat, lon)
+
+	def insert(self, i, lat, lon):
+		self.pts.insert(i, (lat, lon))
+		n = len(self.pts)
+		if n == 1:
+			return
+		if 0 < i < n - 1:
+			self.total = self.total - self.segs.pop(i - 1)
+		new = []
+		if i > 0:
+			new.append(self.seg(i - 1))
+		if i < n - 1:
+			new.append(self.seg(i))
+		self.segs[max(i - 1, 0):max(i - 1, 0)] = new
+		self.total = self.total + sum(new)
+
+	def move(self, i, lat, lon):
+		self.pts[i] = (lat, lon)
+		for j in (i - 1, i):
+			if 0 <= j < len(self.segs):
+				old = self.segs[j]
+				self.segs[j] = self.seg(j)
+				self.total = self.total + self.segs[j] - old
+
+	def remove(self, i):
+		n = len(self.pts)
+		if n > 1:
+			if 0 < i < n - 1:
+				self.total = self.total - self.segs[i - 1] - self.segs[i]
+				self.segs[i - 1:i + 1] = [geometry.distance(self.pts[i - 1], self.pts[i + 1])]
+				self.total = self.total + self.segs[i - 1]
+			else:
+				j = 0 if i == 0 else i - 1
+				self.total = self.total - self.segs.pop(j)
+		self.pts.pop(i)
+		if len(self.pts) < 2:
+			self.total = 0.0
+
+	def get_length(self):
+		""" So calc_track_length() can take one """
+		return self.total
@@ -0,0 +1,188 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Author: Don Atherton
+# Web: https://donatherton.co.uk
+
+""" Shows a track on the map with only the vertices the zoom level and view need """
+
+import gi
+gi.require_version('OsmGpsMap', '1.0')
+from gi.repository import OsmGpsMap
+import numpy as np
+import geometry
+from simplify import Pyramid
+
+# Vertices per MapTrack; each chunk is shown or hidden as a whole
+CHUNK = 256
+# Chunks this far outside the view (as a fraction of its size) are kept,
+# so small pans don't add and remove MapTracks
+MARGIN = 0.5
+
+def chunk_bounds(lat, lon):
+	""" lat_min, lat_max, lon_min, lon_max of each chunk, where chunk c
+	is vertices c*CHUNK to (c+1)*CHUNK inclusive so neighbours join up """
+	n = len(lat)
+	if n == 0:
+		return [np.empty(0)] * 4
+	starts = np.arange(0, max(n - 1, 1), CHUNK)
+	ends = np.minimum(starts + CHUNK, n - 1)
+	bounds = []
+	for a in (lat, lon):
+		lo = np.minimum(np.minimum.reduceat(a, starts), a[ends])
+		hi = np.maximum(np.maximum.reduceat(a, starts), a[ends])
+		bounds.extend((lo, hi))
+	return bounds[0], bounds[1], bounds[2], bounds[3]
+
+class TrackLayer:
+	def __init__(self, osm, track=None, pyramid=None, signals=(), **props):
+		""" Draws a Track, simplified for the zoom with a Pyramid and cut into
+		chunks so only those near the view are on the map. With track=None
+		the layer starts empty and grows with append(), unsimplified.
+
+		props are passed to each MapTrack made, and signals is a list of
+		(name, handler) to connect on each. The full resolution Track is
+		left untouched for length, elevation and export. """
+		self.osm = osm
+		self.track = track
+		self.signals = signals
+		self.props = props
+		if track is not None:
+			self.lat = track.lat
+			self.lon = track.lon
+			self.n = len(track)
+			if pyramid is None:
+				pyramid = Pyramid(track.lat, track.lon, max_zoom=osm.props.max_zoom)
+		else:
+			self.lat = np.empty(1024)
+			self.lon = np.empty(1024)
+			self.n = 0
+			self.length = 0.0
+		self.pyramid = pyramid
+		self.zoom = None
+		self.idx = None
+		self.bounds = chunk_bounds(self.lat[:0], self.lon[:0])
+		self.shown = {}
+		self.handler = osm.connect('changed', self.update)
+		self.update()
+
+	def update(self, *args):
+		""" Swaps levels on zoom, then shows and hides chunks for the new view """
+		zoom = self.osm.props.zoom
+		if zoom != self.zoom:
+			self.zoom = zoom
+			self.hide_all()
+			if self.pyramid is not None:
+				self.idx = self.pyramid.level(zoom)
+				self.bounds = chunk_bounds(self.lat[self.idx], self.lon[self.idx])
+			else:
+				self.bounds = chunk_bounds(self.lat[:self.n], self.lon[:self.n])
+
+		visible = self.visible()
+		for c in [c for c in self.shown if c not in visible]:
+			self.osm.track_remove(self.shown.pop(c))
+		for c in visible:
+			if c not in self.shown:
+				self.show(c)
+
+	def visible(self):
+		""" Chunks whose bounds meet the view plus MARGIN """
+		pt1, pt2 = self.osm.get_bbox()
+		lat1, lon1 = pt1.get_degrees()
+		lat2, lon2 = pt2.get_degrees()
+		s, n = min(lat1, lat2), max(lat1, lat2)
+		w, e = min(lon1, lon2), max(lon1, lon2)
+		dlat = (n - s) * MARGIN
+		dlon = (e - w) * MARGIN
+		lat_min, lat_max, lon_min, lon_max = self.bounds
+		mask = (lat_max >= s - dlat) & (lat_min <= n + dlat) & (lon_max >= w - dlon) & (lon_min <= e + dlon)
+		return set(np.flatnonzero(mask).tolist())
+
+	def vertices(self, c):
+		""" lat and lon lists for chunk c at the current level """
+		if self.idx is not None:
+			idx = self.idx[c * CHUNK:(c + 1) * CHUNK + 1]
+			return self.lat[idx].tolist(), self.lon[idx].tolist()
+		end = min((c + 1) * CHUNK + 1, self.n)
+		return self.lat[c * CHUNK:end].tolist(), self.lon[c * CHUNK:end].tolist()
+
+	def show(self, c):
+		maptrack = OsmGpsMap.MapTrack(**self.props)
+		lat, lon = self.vertices(c)
+		for i in range(len(lat)):
+			pt = OsmGpsMap.MapPoint()
+			pt.set_degrees(lat[i],lon[i])
+			maptrack.add_point(pt)
+		for signal, handler in self.signals:
+			maptrack.connect(signal, handler)
+		self.osm.track_add(maptrack)
+		self.shown[c] = maptrack
+
+	def hide_all(self):
+		for maptrack in self.shown.values():
+			self.osm.track_remove(maptrack)
+		self.shown = {}
+
+	def append(self, lat, lon):
+		""" Adds a point to the end of an unsimplified layer, e.g. a GPS track """
+		if self.n == len(self.lat):
+			self.lat = np.resize(self.lat, 2 * self.n)
+			self.lon = np.resize(self.lon, 2 * self.n)
+		self.lat[self.n] = lat
+		self.lon[self.n] = lon
+		self.n = self.n + 1
+		if self.n > 1:
+			self.length = self.length + geometry.distance((self.lat[self.n-2], self.lon[self.n-2]), (lat, lon))
+
+		# Only the last chunk changes. A new one starts at the previous vertex.
+		c = max(self.n - 2, 0) // CHUNK
+		prev = max(self.n - 2, 0)
+		if c == len(self.bounds[0]):
+			first = (self.lat[prev], self.lat[prev], self.lon[prev], self.lon[prev])
+			self.bounds = tuple(np.append(b, v) for b, v in zip(self.bounds, first))
+		lat_min, lat_max, lon_min, lon_max = self.bounds
+		lat_min[c] = min(lat_min[c], lat)
+		lat_max[c] = max(lat_max[c], lat)
+		lon_min[c] = min(lon_min[c], lon)
+		lon_max[c] = max(lon_max[c], lon)
+
+		if c in self.shown:
+			pt = OsmGpsMap.MapPoint()
+			pt.set_degrees(lat,lon)
+			self.shown[c].add_point(pt)
+		elif c in self.visible():
+			self.show(c)
+
+	def replace(self, lat, lon):
+		""" Swaps all the points of an unsimplified layer, e.g. for a thinned
+		GPS trail. The length carries on from what it was. """
+		self.n = len(lat)
+		self.lat = np.resize(np.asarray(lat, dtype=float), max(2 * self.n, 1024))
+		self.lon = np.resize(np.asarray(lon, dtype=float), max(2 * self.n, 1024))
+		self.bounds = chunk_bounds(self.lat[:self.n], self.lon[:self.n])
+		self.hide_all()
+		self.update()
+
+	def points(self):
+		""" Full resolution lat and lon arrays """
+		return self.lat[:self.n], self.lon[:self.n]
+
+	def get_length(self):
+		""" Full resolution length, so calc_track_length() can take a layer """
+		if self.track is not None:
+			return self.track.length
+		return self.length
+
+	def remove(self):
+		self.osm.disconnect(self.handler)
+		self.hide_all()